@@ -0,0 +1,122 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from config import ANIMATION_EDIT_BUDGET, ANIMATION_DURATION, ANIMATION_CHAT_INTERVAL
+from rate_limiter import request_priority, ANIMATION, INTERACTIVE
+
+
+class AnimationScheduler:
+    """
+    Plays roulette animations within a global message edit budget.
+
+    Concurrent spins share ``edit_budget`` edits per second. The more spins
+    run at once, the fewer intermediate frames each one gets (spread over
+    the same ``duration``), down to the final frame alone under pressure.
+    Intermediate frames are skipped when a chat was edited less than
+    ``chat_interval`` seconds ago, when the animation has fallen behind
+    schedule, or while Telegram asks us to back off. The final frame is
+    always sent.
+    """
+
+    def __init__(self, edit_budget: float = ANIMATION_EDIT_BUDGET,
+                 duration: float = ANIMATION_DURATION,
+                 chat_interval: float = ANIMATION_CHAT_INTERVAL):
+        self.edit_budget = edit_budget
+        self.duration = duration
+        self.chat_interval = chat_interval
+        self.active = 0
+        self._edits: deque = deque()
+        self._chat_last_edit: Dict[int, float] = {}
+        self._paused_until = 0.0
+
+    def edit_rate(self) -> int:
+        """Edits made during the last second."""
+        now = time.monotonic()
+        while self._edits and now - self._edits[0] > 1.0:
+            self._edits.popleft()
+        return len(self._edits)
+
+    def plan(self, frame_count: int) -> Tuple[List[int], float]:
+        """Indices of intermediate frames to show and the interval between them."""
+        share = self.edit_budget / max(1, self.active)
+        shown = min(frame_count - 1, int(self.duration * share))
+        if shown <= 0:
+            return [], 0.0
+
+        # Evenly spaced, always ending with the frame right before the result
+        last = frame_count - 2
+        step = last / max(1, shown - 1)
+        indices = [last - int(round((shown - 1 - k) * step)) for k in range(shown)]
+        return indices, self.duration / shown
+
+    async def play(self, message: Message, frames: List[str]) -> None:
+        """Show ``frames`` in ``message``; the last frame is the result."""
+        self.active += 1
+        try:
+            indices, interval = self.plan(len(frames))
+            started = time.monotonic()
+
+            for k, index in enumerate(indices):
+                delay = started + k * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                # Fell behind: the next frame is already due, skip this one
+                if k + 1 < len(indices) and time.monotonic() >= started + (k + 1) * interval:
+                    continue
+                if not self._may_edit(message.chat.id):
+                    continue
+
+                await self._edit(message, frames[index])
+
+            delay = started + len(indices) * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._edit(message, frames[-1], final=True)
+        finally:
+            self.active -= 1
+
+    def _may_edit(self, chat_id: int) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        if now - self._chat_last_edit.get(chat_id, 0.0) < self.chat_interval:
+            return False
+        return self.edit_rate() < self.edit_budget
+
+    async def _edit(self, message: Message, text: str, final: bool = False) -> None:
+        now = time.monotonic()
+        self._edits.append(now)
+        self._chat_last_edit[message.chat.id] = now
+        # Промежуточные кадры уступают очередь платежам и ответам, результат - нет
+        priority = request_priority.set(INTERACTIVE if final else ANIMATION)
+        try:
+            await message.edit_text(text)
+        except TelegramRetryAfter as e:
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await message.edit_text(text)
+        except TelegramBadRequest as e:
+            # "message is not modified" when two frames are the same
+            logging.debug(f"Animation frame skipped: {e}")
+        finally:
+            request_priority.reset(priority)
+            if len(self._chat_last_edit) > 10_000:
+                self._forget_idle_chats()
+
+    def _forget_idle_chats(self) -> None:
+        now = time.monotonic()
+        self._chat_last_edit = {
+            chat_id: last for chat_id, last in self._chat_last_edit.items()
+            if now - last < self.chat_interval
+        }
+
+
+animations = AnimationScheduler()
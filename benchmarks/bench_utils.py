@@ -0,0 +1,222 @@
+"""
+Microbenchmarks for the hot utility paths.
+
+Builds synthetic datasets of 1k, 100k and 1M users in a temporary data
+directory and measures spin_roulette, save_json_data, load_initial_data,
+add_user, get_global_roulette_stats and generate_animation_sequence.
+add_user only marks the users file dirty; add_user_x1000_flushed adds
+1000 users and waits for the write-behind flush, so the file write is
+measured too. The temporary directory is removed at exit.
+Reports ops/sec, p50/p99 latency and peak traced memory per operation,
+and compares ops/sec against the stored baseline.
+
+    python -m benchmarks.bench_utils                  # compare with baseline.json
+    python -m benchmarks.bench_utils --sizes 1000     # quick run
+    python -m benchmarks.bench_utils --save           # record a new baseline
+"""
+import os
+import gc
+import sys
+import json
+import shutil
+import atexit
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+
+# config.py resolves the data directory relative to the working directory,
+# so move into a scratch directory before importing the bot modules.
+sys.path.insert(0, str(ROOT))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="bench-")
+os.chdir(SCRATCH_DIR)
+
+
+@atexit.register
+def remove_scratch_dir() -> None:
+    os.chdir(ROOT)
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+from config import USERS_FILE, STATS_SNAPSHOT_FILE, GIFT_VALUES, SPIN_COSTS  # noqa: E402
+from persistence import write_behind  # noqa: E402
+from utils import (  # noqa: E402
+    add_user, spin_roulette, save_json_data,
+    load_initial_data, generate_animation_sequence
+)
+from ledger import build_roulette_totals, load_roulette_stats  # noqa: E402
+from handlers.admin import get_global_roulette_stats  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def make_dataset(size: int, seed: int = 1):
+    """Synthetic users and per-user roulette stats (every 5th user has played)."""
+    rng = random.Random(seed)
+    gifts = list(GIFT_VALUES)
+    users_data = {}
+    roulette_stats = {}
+    for user_id in range(1, size + 1):
+        users_data[str(user_id)] = {
+            "username": f"user{user_id}",
+            "status": "removed" if rng.random() < 0.1 else "active",
+            "joined_at": "01.04.2025 21:41:53"
+        }
+        if user_id % 5 == 0:
+            spins = rng.randint(1, 20)
+            roulette_stats[str(user_id)] = {
+                "total_spins": spins,
+                "spins_without_win": rng.randint(0, 6),
+                "total_spent": spins * 50,
+                "total_won": spins * 20,
+                "gifts": {rng.choice(gifts): spins}
+            }
+    return users_data, roulette_stats
+
+
+def write_dataset(users_data, roulette_stats) -> None:
+    for name in os.listdir("data"):
+        os.remove(os.path.join("data", name))
+    save_json_data(USERS_FILE, users_data)
+    save_json_data(STATS_SNAPSHOT_FILE, {
+        "ledger_offset": 0,
+        "roulette_stats": roulette_stats,
+        "totals": build_roulette_totals(load_roulette_stats(roulette_stats))
+    })
+
+
+def measure(fn, min_time: float = 1.0, max_iterations: int = 100_000, min_iterations: int = 3) -> dict:
+    """Time ``fn`` repeatedly, then trace the peak memory of a single call."""
+    timings = []
+    deadline = time.perf_counter() + min_time
+    gc.collect()
+    while len(timings) < min_iterations or (
+        time.perf_counter() < deadline and len(timings) < max_iterations
+    ):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(timings, peak)
+
+
+async def measure_async(fn, min_time: float = 1.0, max_iterations: int = 100_000,
+                        min_iterations: int = 3) -> dict:
+    """``measure`` for coroutine functions."""
+    timings = []
+    deadline = time.perf_counter() + min_time
+    gc.collect()
+    while len(timings) < min_iterations or (
+        time.perf_counter() < deadline and len(timings) < max_iterations
+    ):
+        started = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    await fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(timings, peak)
+
+
+def summarize(timings: list, peak: int) -> dict:
+    timings.sort()
+    return {
+        "ops_per_sec": len(timings) / sum(timings),
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6,
+        "peak_kb": peak / 1024,
+        "iterations": len(timings)
+    }
+
+
+async def run_size(size: int) -> dict:
+    users_data, roulette_stats = make_dataset(size)
+    write_dataset(users_data, roulette_stats)
+    heavy = dict(min_time=0.5, max_iterations=20, min_iterations=1 if size >= 1_000_000 else 3)
+    results = {}
+
+    results["load_initial_data"] = measure(load_initial_data, **heavy)
+    results["save_json_data"] = measure(lambda: save_json_data(USERS_FILE, users_data), **heavy)
+
+    data = load_initial_data()
+    storage = data["storage"]
+    write_behind.start()
+    try:
+        next_id = iter(range(size + 1, size * 10 + 1_000_000))
+
+        async def add_users_flushed():
+            for _ in range(1000):
+                add_user(storage, next(next_id), "bench")
+            await write_behind.flush()
+
+        # Before add_user: its hundreds of thousands of new users would
+        # inflate the file every flush writes
+        results["add_user_x1000_flushed"] = await measure_async(add_users_flushed, **heavy)
+        results["add_user"] = measure(lambda: add_user(storage, next(next_id), "bench"))
+
+        spin_types = list(SPIN_COSTS)
+        players = list(range(1, size + 1))
+        results["spin_roulette"] = measure(
+            lambda: spin_roulette(random.choice(spin_types), random.choice(players), storage)
+        )
+
+        def global_stats():
+            storage.roulette_version += 1  # force a fresh render, no cached text
+            get_global_roulette_stats(storage)
+
+        results["get_global_roulette_stats"] = measure(global_stats)
+        results["generate_animation_sequence"] = measure(lambda: generate_animation_sequence("rose"))
+    finally:
+        await storage.close()
+        await write_behind.close()
+
+    return results
+
+
+def print_results(size: int, results: dict, baseline: dict) -> None:
+    print(f"\n== {size} users ==")
+    print(f"{'benchmark':<30}{'ops/sec':>14}{'p50 us':>12}{'p99 us':>12}{'peak KiB':>12}{'vs baseline':>14}")
+    for name, r in results.items():
+        base = baseline.get(str(size), {}).get(name)
+        diff = f"{(r['ops_per_sec'] / base['ops_per_sec'] - 1):+.1%}" if base else "-"
+        print(
+            f"{name:<30}{r['ops_per_sec']:>14.1f}{r['p50_us']:>12.1f}"
+            f"{r['p99_us']:>12.1f}{r['peak_kb']:>12.1f}{diff:>14}"
+        )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the hot utility paths")
+    parser.add_argument("--sizes", default="1000,100000,1000000",
+                        help="comma-separated dataset sizes (users)")
+    parser.add_argument("--save", action="store_true", help=f"write results to {BASELINE_FILE.name}")
+    args = parser.parse_args(argv)
+
+    baseline = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+    all_results = {}
+    for size in (int(s) for s in args.sizes.split(",")):
+        results = asyncio.run(run_size(size))
+        print_results(size, results, baseline)
+        all_results[str(size)] = results
+
+    if args.save:
+        baseline.update(all_results)
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline written to {BASELINE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
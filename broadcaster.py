@@ -0,0 +1,366 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest
+)
+
+from config import (
+    BROADCAST_RATE, BROADCAST_WORKERS, BROADCAST_MAX_RETRIES,
+    BROADCAST_JOB_FILE, BROADCAST_RECIPIENTS_FILE, BROADCAST_PROGRESS_INTERVAL
+)
+from keyboards import create_broadcast_control_keyboard
+from persistence import load_json_data, write_behind, write_file_atomic, dump_json
+from storage import Storage
+from utils import remove_user
+from rate_limiter import request_priority, BROADCAST
+
+
+class TokenBucket:
+    """Token bucket shared by all senders, with a global pause for 429s."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for ``seconds``."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastJob:
+    """Persisted state of a broadcast; ``cursor`` indexes the recipient list."""
+    admin_chat_id: int
+    from_chat_id: int
+    message_id: int
+    total: int
+    cursor: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    status: str = "running"  # running | paused | cancelled | done
+    progress_message_id: Optional[int] = None
+    elapsed: float = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("running", "paused")
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.cursor
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as "1 ч 2 мин 3 сек"."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} ч")
+    if minutes:
+        parts.append(f"{minutes} мин")
+    parts.append(f"{seconds} сек")
+    return " ".join(parts)
+
+
+def estimate_duration(recipients: int, rate: float = BROADCAST_RATE) -> float:
+    """Expected broadcast duration in seconds at the configured rate."""
+    return recipients / rate
+
+
+def format_progress(job: BroadcastJob) -> str:
+    """Text of the admin's progress message."""
+    titles = {
+        "running": "📨 Рассылка идёт",
+        "paused": "⏸ Рассылка приостановлена",
+        "cancelled": "⛔ Рассылка отменена",
+        "done": "✅ Рассылка завершена"
+    }
+    text = (
+        f"{titles.get(job.status, 'Рассылка')}\n\n"
+        f"Отправлено: {job.sent}\n"
+        f"Ошибок: {job.failed} (заблокировали бота: {job.blocked})\n"
+        f"Осталось: {job.remaining} из {job.total}\n"
+        f"Время: {format_duration(job.elapsed)}, скорость: {job.throughput:.1f} сообщ./сек"
+    )
+    if job.status == "running":
+        rate = job.throughput or BROADCAST_RATE
+        text += f"\nОсталось примерно: {format_duration(job.remaining / rate)}"
+    return text
+
+
+class Broadcaster:
+    """
+    Sends one message to many users with a pool of concurrent senders.
+
+    The message is copied with ``copy_message``, so every content type is
+    handled the same way. All senders share one token bucket sized below
+    Telegram's ~30 msg/s limit; a 429 pauses the whole bucket for
+    ``retry_after`` seconds. Users who blocked the bot are marked removed.
+    """
+
+    def __init__(self, bot: Bot, storage: Storage, rate: float = BROADCAST_RATE,
+                 workers: int = BROADCAST_WORKERS, max_retries: int = BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.storage = storage
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_retries = max_retries
+
+    async def run(self, job: BroadcastJob, user_ids: List[int], on_update=None) -> None:
+        """
+        Send to ``user_ids[job.cursor:]`` until done or ``job.status`` changes.
+
+        ``job.cursor`` only moves past recipients whose send has finished, so
+        a job interrupted at any point resumes without skipping anyone.
+        """
+        next_index = job.cursor
+        in_flight = set()
+        started = time.monotonic()
+        elapsed_before = job.elapsed
+
+        async def sender():
+            nonlocal next_index
+            while job.status == "running" and next_index < len(user_ids):
+                index = next_index
+                next_index += 1
+                in_flight.add(index)
+
+                if await self._send(user_ids[index], job):
+                    job.sent += 1
+                else:
+                    job.failed += 1
+
+                in_flight.discard(index)
+                job.cursor = min(in_flight) if in_flight else next_index
+                job.elapsed = elapsed_before + time.monotonic() - started
+                if on_update is not None:
+                    on_update(job)
+
+        senders = [
+            asyncio.create_task(sender())
+            for _ in range(max(1, min(self.workers, len(user_ids) - job.cursor)))
+        ]
+        try:
+            await asyncio.gather(*senders)
+        finally:
+            for task in senders:
+                task.cancel()
+            job.elapsed = elapsed_before + time.monotonic() - started
+
+        if job.status == "running" and job.cursor >= len(user_ids):
+            job.status = "done"
+
+    async def _send(self, user_id: int, job: BroadcastJob) -> bool:
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=job.from_chat_id,
+                    message_id=job.message_id
+                )
+                return True
+            except TelegramRetryAfter as e:
+                logging.warning(f"Broadcast hit flood limit, pausing for {e.retry_after} s")
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота
+                remove_user(self.storage, user_id)
+                job.blocked += 1
+                return False
+            except TelegramBadRequest as e:
+                logging.error(f"Error sending broadcast to user {user_id}: {e}")
+                return False
+            except Exception as e:
+                logging.error(f"Error sending broadcast to user {user_id}: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+        return False
+
+
+class BroadcastManager:
+    """
+    Runs at most one broadcast job in the background.
+
+    The job state and its recipient list are persisted, so a job that was
+    running when the bot stopped resumes from its cursor on the next start.
+    The admin's progress message is edited every
+    ``BROADCAST_PROGRESS_INTERVAL`` seconds.
+    """
+
+    def __init__(self, bot: Bot, storage: Storage):
+        self.bot = bot
+        self.storage = storage
+        self.job: Optional[BroadcastJob] = None
+        self._user_ids: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def status(self) -> Optional[str]:
+        """Status of the current job, or None when nothing is in progress."""
+        return self.job.status if self.job is not None and self.job.active else None
+
+    def load(self) -> None:
+        """Load the persisted job, if any."""
+        data = load_json_data(BROADCAST_JOB_FILE)
+        if not data:
+            return
+
+        self.job = BroadcastJob(**data)
+        if self.job.active:
+            self._user_ids = load_json_data(BROADCAST_RECIPIENTS_FILE).get("user_ids", [])
+            logging.info(
+                f"Loaded {self.job.status} broadcast at {self.job.cursor}/{self.job.total}"
+            )
+
+    def start(self) -> None:
+        """Resume a job that was running when the bot stopped."""
+        if self.job is not None and self.job.status == "running":
+            self._spawn()
+
+    async def create(self, admin_chat_id: int, from_chat_id: int, message_id: int) -> BroadcastJob:
+        """Start a new broadcast to every active user."""
+        self._user_ids = list(self.storage.iter_active_user_ids())
+        await asyncio.to_thread(
+            write_file_atomic, BROADCAST_RECIPIENTS_FILE, dump_json({"user_ids": self._user_ids})
+        )
+
+        self.job = BroadcastJob(
+            admin_chat_id=admin_chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            total=len(self._user_ids)
+        )
+        progress = await self.bot.send_message(
+            chat_id=admin_chat_id,
+            text=format_progress(self.job),
+            reply_markup=create_broadcast_control_keyboard(self.job.status)
+        )
+        self.job.progress_message_id = progress.message_id
+        self._save()
+        self._spawn()
+        return self.job
+
+    def pause(self) -> None:
+        if self.job is not None and self.job.status == "running":
+            self.job.status = "paused"
+            self._save()
+
+    def resume(self) -> None:
+        if self.job is not None and self.job.status == "paused":
+            self.job.status = "running"
+            self._save()
+            self._spawn()
+
+    async def cancel(self) -> None:
+        if self.job is not None and self.job.active:
+            was_running = self._task is not None
+            self.job.status = "cancelled"
+            self._save()
+            if not was_running:
+                await self._finish()
+
+    async def close(self) -> None:
+        """Stop the job without changing its status so it resumes on restart."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.job is not None:
+            self._save()
+
+    def _save(self) -> None:
+        write_behind.mark_dirty(BROADCAST_JOB_FILE, asdict(self.job))
+
+    def _spawn(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        # Запросы этой задачи и её отправителей идут последними в общей очереди
+        request_priority.set(BROADCAST)
+        job = self.job
+        broadcaster = Broadcaster(self.bot, self.storage)
+        progress = asyncio.create_task(self._report_progress(job))
+        try:
+            # Пауза и продолжение могли произойти, пока отправители завершались
+            while job.status == "running":
+                await broadcaster.run(job, self._user_ids, on_update=lambda _: self._save())
+        except Exception as e:
+            logging.error(f"Broadcast failed: {e}")
+            job.status = "paused"
+        finally:
+            progress.cancel()
+            self._task = None
+
+        self._save()
+        if job.status == "paused":
+            await self._edit_progress(job)
+        else:
+            await self._finish()
+
+    async def _finish(self) -> None:
+        """Final report for a done or cancelled job."""
+        job = self.job
+        if os.path.exists(BROADCAST_RECIPIENTS_FILE):
+            os.remove(BROADCAST_RECIPIENTS_FILE)
+        self._user_ids = []
+        await self._edit_progress(job)
+
+    async def _report_progress(self, job: BroadcastJob) -> None:
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            await self._edit_progress(job)
+
+    async def _edit_progress(self, job: BroadcastJob) -> None:
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job.admin_chat_id,
+                message_id=job.progress_message_id,
+                text=format_progress(job),
+                reply_markup=create_broadcast_control_keyboard(job.status) if job.active else None
+            )
+        except TelegramBadRequest as e:
+            # "message is not modified" и т.п.
+            logging.debug(f"Could not update broadcast progress: {e}")
+        except Exception as e:
+            logging.error(f"Could not update broadcast progress: {e}")
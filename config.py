@@ -16,10 +16,77 @@ USERS_FILE = os.path.join(DATA_DIR, "users.json")
 REFERRALS_FILE = os.path.join(DATA_DIR, "referrals.json")
 CREDITED_REFERRALS_FILE = os.path.join(DATA_DIR, "credited.json")
 STATS_FILE = os.path.join(DATA_DIR, "stats.json")
+SQLITE_FILE = os.path.join(DATA_DIR, "bot.db")
+
+# Spin ledger: one line per spin, compacted into a stats snapshot.
+# STATS_FILE is only read until the first snapshot is written.
+LEDGER_FILE = os.path.join(DATA_DIR, "spins.ledger")
+STATS_SNAPSHOT_FILE = os.path.join(DATA_DIR, "stats.snapshot.json")
+LEDGER_COMPACT_INTERVAL = 300  # seconds
+
+# Binary snapshots of users and stats written next to the JSON files for a
+# faster startup (msgpack if installed, marshal otherwise). The JSON files stay
+# the source of truth: a snapshot is only read while its JSON file is unchanged.
+BINARY_SNAPSHOTS = True
+USERS_SNAPSHOT_FILE = os.path.join(DATA_DIR, "users.snap")
+STATS_BINARY_SNAPSHOT_FILE = os.path.join(DATA_DIR, "stats.snap")
+
+# Storage backend: "json" (files above), "sqlite" (SQLITE_FILE) or "lazy"
+# (SQLITE_FILE, only recently active users kept in memory).
+# Import existing JSON files into SQLite with `python sqlite_storage.py`.
+STORAGE_BACKEND = "json"
+LAZY_CACHE_SIZE = 50_000  # users (and their roulette stats) kept in memory
+LAZY_FLUSH_INTERVAL = 1  # seconds between write-backs of changed records
+
+# Состояния FSM (выбранная ставка и т.п.) переживают перезапуск бота
+FSM_STORAGE_FILE = os.path.join(DATA_DIR, "fsm.db")
+FSM_FLUSH_INTERVAL_MS = 100
+FSM_CACHE_TTL = 60  # seconds an idle state stays cached; writes by other processes drop the cache
 
 # Create data directory if it doesn't exist
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# HTTP connection pool for Bot API calls
+HTTP_POOL_SIZE = 100
+HTTP_TIMEOUT = 30  # seconds
+
+# Общий лимит исходящих запросов (rate_limiter.py): Telegram допускает
+# ~30 сообщений в секунду на бота, ~1 в секунду в чат и 20 в минуту в группу
+API_RATE = 30  # messages per second for the whole bot
+API_BURST = 30
+API_CHAT_RATE = 1  # messages per second in one private chat
+API_CHAT_BURST = 5
+API_GROUP_RATE = 20 / 60  # messages per second in one group or channel
+API_GROUP_BURST = 3
+API_MAX_RETRIES = 3  # resends after a 429
+API_MAX_RETRY_WAIT = 60  # seconds; longer retry_after is passed to the caller
+
+# Режим получения обновлений: "polling" или "webhook".
+# В режиме webhook Telegram шлёт обновления на WEBHOOK_URL + WEBHOOK_PATH,
+# бот слушает WEBHOOK_HOST:WEBHOOK_PORT (например, за nginx или балансировщиком)
+RUN_MODE = "polling"
+WEBHOOK_URL = "https://example.com"  # public base URL, without the path
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET = ""  # empty: a random secret token on every start
+WEBHOOK_MAX_CONNECTIONS = 100
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = "127.0.0.1"  # only local scrapers by default
+METRICS_PORT = 9746  # 0 disables the endpoint; 9100 is taken by node_exporter
+
+# Профилирование по командам /profile и /memprofile
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL_MS = 5
+PROFILE_TRACEMALLOC_FRAMES = 1  # frames per allocation traceback; more is slower
+PROFILE_TOP = 25  # lines in the summary sent to the admin
+
+# Write-behind persistence: flush dirty files at most every N ms or M changes
+FLUSH_INTERVAL_MS = 500
+FLUSH_MAX_CHANGES = 100
+
 # Roulette constants
 GIFT_VALUES = {
     "heart": 15,  # Сердце
@@ -82,3 +149,37 @@ SPIN_COSTS = {
     "standard": 50,
     "premium": 100
 }
+
+# Канал, подписку на который проверяет бот (бот должен быть его администратором,
+# чтобы получать chat_member обновления)
+SUBSCRIPTION_CHANNEL = "@GiftsForFree_News"
+SUBSCRIPTION_CACHE_TTL = 600  # seconds
+SUBSCRIPTION_CACHE_SIZE = 100_000
+
+# Доставка подарков
+GIFT_OUTBOX_FILE = os.path.join(DATA_DIR, "gift_outbox.json")
+GIFT_WORKERS = 4
+GIFT_MAX_ATTEMPTS = 8
+GIFT_RETRY_BASE = 2  # seconds, doubled after every failed attempt
+GIFT_RETRY_MAX = 300  # seconds
+# Выданные платежи хранятся дольше, чем Telegram повторяет доставку апдейта (24 часа)
+GIFT_DELIVERED_LOG = os.path.join(DATA_DIR, "gift_delivered.log")
+GIFT_DELIVERED_RETENTION = 7 * 24 * 3600  # seconds
+GIFT_HOLD = 30  # seconds a new gift waits for the spin animation at most
+
+# Анимация рулетки: общий бюджет редактирований на все одновременные прокруты
+ANIMATION_EDIT_BUDGET = 20  # edits per second
+ANIMATION_DURATION = 3.5  # seconds
+ANIMATION_CHAT_INTERVAL = 0.25  # minimal seconds between edits in one chat
+
+# Рассылка: Telegram допускает ~30 сообщений в секунду
+BROADCAST_RATE = 25  # messages per second
+BROADCAST_WORKERS = 10
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_PROGRESS_INTERVAL = 5  # seconds between progress message updates
+BROADCAST_JOB_FILE = os.path.join(DATA_DIR, "broadcast_job.json")
+BROADCAST_RECIPIENTS_FILE = os.path.join(DATA_DIR, "broadcast_recipients.json")
+
+# Выгрузка пользователей: gzip-части меньше лимита Telegram на файлы (50 МБ)
+EXPORT_PART_SIZE = 45 * 1024 * 1024  # bytes of compressed data per file
+EXPORT_BATCH_SIZE = 1000  # users formatted between event loop yields
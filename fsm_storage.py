@@ -0,0 +1,155 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import FSM_STORAGE_FILE, FSM_FLUSH_INTERVAL_MS, FSM_CACHE_TTL
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL
+);
+"""
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage on an SQLite database in WAL mode.
+
+    Changes are kept in memory and written in one transaction every
+    ``flush_interval`` ms; ``close()`` writes whatever is left. Reads are
+    served from an in-memory cache that is dropped whenever another process
+    sharing the database has committed (``PRAGMA data_version``), so a state
+    written elsewhere is never shadowed. Entries idle for ``cache_ttl``
+    seconds are evicted (0 disables the cache).
+    """
+
+    def __init__(self, path: str = FSM_STORAGE_FILE, flush_interval: int = FSM_FLUSH_INTERVAL_MS,
+                 cache_ttl: float = FSM_CACHE_TTL, key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.flush_interval = flush_interval / 1000
+        self.cache_ttl = cache_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+
+        # key -> (state, data, cached_at)
+        self._cache: Dict[str, Tuple[Optional[str], Dict[str, Any], float]] = {}
+        # key -> (state, data) waiting to be written
+        self._dirty: Dict[str, Tuple[Optional[str], Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._purged_at = time.monotonic()
+        self._data_version = self._read_data_version()
+
+    def start(self) -> None:
+        """Start the background flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+        self.conn.close()
+
+    def flush(self) -> None:
+        """Write all pending changes in one transaction."""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "DELETE FROM fsm WHERE key = ?",
+                    ((key,) for key, (state, data) in dirty.items() if state is None and not data)
+                )
+                self.conn.executemany(
+                    "INSERT INTO fsm (key, state, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    (
+                        (key, state, json.dumps(data, ensure_ascii=False))
+                        for key, (state, data) in dirty.items() if state is not None or data
+                    )
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error flushing FSM states: {e}")
+            # Newer changes made meanwhile win
+            self._dirty = {**dirty, **self._dirty}
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+            if time.monotonic() - self._purged_at >= self.cache_ttl:
+                self._purge_cache()
+
+    def _purge_cache(self) -> None:
+        """Drop expired cache entries so idle users do not pile up in memory."""
+        now = self._purged_at = time.monotonic()
+        self._cache = {
+            key: entry for key, entry in self._cache.items() if now - entry[2] < self.cache_ttl
+        }
+
+    def _read_data_version(self) -> int:
+        # Меняется, когда в базу пишет другое соединение; свои коммиты не в счёт
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        if key in self._dirty:
+            return self._dirty[key]
+
+        if self._cache:
+            version = self._read_data_version()
+            if version != self._data_version:
+                self._data_version = version
+                self._cache.clear()
+
+        entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - entry[2] < self.cache_ttl:
+            return entry[0], entry[1]
+
+        row = self.conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        state, data = (row[0], json.loads(row[1])) if row else (None, {})
+        self._store(key, state, data, dirty=False)
+        return state, data
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any], dirty: bool = True) -> None:
+        if state is None and not data:
+            self._cache.pop(key, None)
+        else:
+            self._cache[key] = (state, data, time.monotonic())
+        if dirty:
+            self._dirty[key] = (state, data)
+            if self._task is None:
+                # Not started (scripts, shutdown): write through
+                self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = self._load(storage_key)
+        self._store(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._load(self.key_builder.build(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = self._load(storage_key)
+        self._store(storage_key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._load(self.key_builder.build(key))[1].copy()
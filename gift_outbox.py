@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter
+)
+
+from config import (
+    GIFT_IDS, GIFT_NAMES, GIFT_EMOJIS, GIFT_OUTBOX_FILE, GIFT_DELIVERED_LOG, GIFT_DELIVERED_RETENTION,
+    GIFT_HOLD, GIFT_WORKERS, GIFT_MAX_ATTEMPTS, GIFT_RETRY_BASE, GIFT_RETRY_MAX
+)
+from persistence import load_json_data, write_file_atomic, write_json_atomic, dump_json
+
+
+class GiftOutbox:
+    """
+    Durable outbox of gifts owed to users.
+
+    A gift is persisted before the spin handler returns and is then
+    delivered by a pool of workers, retrying with exponential backoff.
+    Every delivery is keyed by its payment charge ID, so a payment is
+    never paid out twice, even if the update is handled again.
+
+    Pending and failed gifts live in ``path``. Delivered payment IDs are
+    appended to ``delivered_log`` and kept for ``retention`` seconds,
+    longer than Telegram redelivers an update.
+    """
+
+    def __init__(self, bot: Bot, path: str = GIFT_OUTBOX_FILE, workers: int = GIFT_WORKERS,
+                 delivered_log: str = GIFT_DELIVERED_LOG, retention: float = GIFT_DELIVERED_RETENTION):
+        self.bot = bot
+        self.path = path
+        self.delivered_log = delivered_log
+        self.retention = retention
+        self.workers = workers
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.failed: Dict[str, Dict[str, Any]] = {}
+        # payment ID -> время выдачи, в порядке выдачи
+        self.delivered: Dict[str, int] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._held: Dict[str, asyncio.TimerHandle] = {}
+        self._write_lock = asyncio.Lock()
+        self._log_lock = asyncio.Lock()
+        self._log_lines = 0
+
+    def load(self) -> None:
+        data = load_json_data(self.path)
+        self.pending = data.get("pending", {})
+        self.failed = data.get("failed", {})
+        # Старый формат держал выданные платежи в том же файле
+        delivered = dict(data.get("delivered", {}))
+        self._log_lines = 0
+        if os.path.exists(self.delivered_log):
+            with open(self.delivered_log, "rb") as f:
+                for line in f:
+                    self._log_lines += 1
+                    try:
+                        record = json.loads(line)
+                        delivered[record["key"]] = record["delivered_at"]
+                    except (ValueError, KeyError) as e:
+                        logging.error(f"Skipping bad record in {self.delivered_log}: {e}")
+
+        # Выданные после последней записи файла очереди
+        done = [key for key in self.pending if key in delivered]
+        for key in done:
+            del self.pending[key]
+
+        cutoff = time.time() - self.retention
+        self.delivered = {
+            key: delivered_at for key, delivered_at in sorted(delivered.items(), key=lambda x: x[1])
+            if delivered_at >= cutoff
+        }
+        if self._log_lines != len(self.delivered):
+            self._rewrite_log(list(self.delivered.items()))
+        if done or "delivered" in data:
+            write_json_atomic(self.path, {"pending": self.pending, "failed": self.failed})
+        logging.info(
+            f"Loaded {len(self.pending)} pending and {len(self.failed)} failed gift deliveries, "
+            f"{len(self.delivered)} delivered in the last {self.retention / 86400:g} days"
+        )
+
+    def seen(self, key: str) -> bool:
+        """Whether a payment has already been turned into a gift."""
+        return key in self.pending or key in self.delivered or key in self.failed
+
+    async def enqueue(self, key: str, user_id: int, chat_id: int, gift: str,
+                      hold: float = 0) -> bool:
+        """
+        Persist a gift owed to a user; returns False for an already known payment.
+
+        With ``hold`` the gift is delivered after ``release(key)`` or ``hold``
+        seconds, whichever comes first, so the user sees the spin before it.
+        """
+        if self.seen(key):
+            return False
+
+        self.pending[key] = {
+            "key": key,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "gift": gift,
+            "attempts": 0,
+            "pay_for_upgrade": False,
+            "created_at": int(time.time()),
+            "not_before": time.time() + hold,
+            "last_error": None
+        }
+        await self._save()
+        if self._queue is not None:
+            self._schedule(key, hold)
+        return True
+
+    def release(self, key: str) -> None:
+        """Deliver a held gift now."""
+        handle = self._held.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+            self._queue.put_nowait(key)
+
+    def backlog(self) -> Dict[str, Any]:
+        """Snapshot of the outbox for the admin panel."""
+        now = int(time.time())
+        oldest = min((d["created_at"] for d in self.pending.values()), default=None)
+        return {
+            "pending": len(self.pending),
+            "failed": len(self.failed),
+            "delivered": len(self.delivered),
+            "oldest_pending_age": now - oldest if oldest is not None else 0,
+            "recent_failures": sorted(
+                self.failed.values(), key=lambda d: d["created_at"], reverse=True
+            )[:10]
+        }
+
+    def start(self) -> None:
+        """Start the delivery workers and queue everything still pending."""
+        if self._tasks:
+            return
+
+        self._queue = asyncio.Queue()
+        now = time.time()
+        for key, delivery in self.pending.items():
+            self._schedule(key, delivery.get("not_before", 0) - now)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for handle in self._held.values():
+            handle.cancel()
+        self._held = {}
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def _schedule(self, key: str, delay: float) -> None:
+        if delay <= 0:
+            self._queue.put_nowait(key)
+            return
+        self._held[key] = asyncio.get_running_loop().call_later(delay, self.release, key)
+
+    async def _save(self) -> None:
+        async with self._write_lock:
+            # Копия на цикле, сериализация и запись - в потоке
+            data = {
+                "pending": {key: dict(delivery) for key, delivery in self.pending.items()},
+                "failed": dict(self.failed)
+            }
+            await asyncio.to_thread(write_json_atomic, self.path, data)
+
+    async def _mark_delivered(self, key: str) -> None:
+        """Record a delivered payment in the log before it leaves ``pending``."""
+        now = int(time.time())
+        line = dump_json({"key": key, "delivered_at": now}) + "\n"
+        async with self._log_lock:
+            await asyncio.to_thread(self._append_log, line)
+            self._log_lines += 1
+            self.delivered[key] = now
+            del self.pending[key]
+
+            # Записи в порядке выдачи: устаревшие - в начале
+            cutoff = now - self.retention
+            while self.delivered:
+                oldest = next(iter(self.delivered))
+                if self.delivered[oldest] >= cutoff:
+                    break
+                del self.delivered[oldest]
+            if self._log_lines > 2 * len(self.delivered) + 1000:
+                # В файле очереди не должно остаться выданных, которых уже нет в логе
+                await self._save()
+                await asyncio.to_thread(self._rewrite_log, list(self.delivered.items()))
+
+    def _append_log(self, line: str) -> None:
+        with open(self.delivered_log, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_log(self, delivered: List[tuple]) -> None:
+        write_file_atomic(self.delivered_log, "".join(
+            dump_json({"key": key, "delivered_at": delivered_at}) + "\n"
+            for key, delivered_at in delivered
+        ))
+        self._log_lines = len(delivered)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._queue.get()
+            delivery = self.pending.get(key)
+            if delivery is None:
+                continue
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                logging.error(f"Gift delivery {key} crashed: {e}")
+
+    async def _deliver(self, delivery: Dict[str, Any]) -> None:
+        key = delivery["key"]
+        gift_id = GIFT_IDS.get(delivery["gift"])
+        delivery["attempts"] += 1
+
+        try:
+            try:
+                await self.bot.send_gift(
+                    gift_id=gift_id,
+                    user_id=delivery["user_id"],
+                    pay_for_upgrade=delivery["pay_for_upgrade"] or None
+                )
+            except TelegramBadRequest as e:
+                # Try with pay_for_upgrade if first attempt fails
+                if "STARGIFT_UPGRADE_UNAVAILABLE" not in e.message or delivery["pay_for_upgrade"]:
+                    raise
+                delivery["pay_for_upgrade"] = True
+                await self.bot.send_gift(
+                    gift_id=gift_id,
+                    user_id=delivery["user_id"],
+                    pay_for_upgrade=True
+                )
+        except (TelegramBadRequest, TelegramForbiddenError) as e:
+            # Повтор не поможет
+            await self._fail(delivery, e.message)
+            return
+        except TelegramRetryAfter as e:
+            await self._retry(delivery, str(e), e.retry_after)
+            return
+        except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+            await self._retry(delivery, str(e))
+            return
+
+        await self._mark_delivered(key)
+        await self._notify(delivery, "{emoji} Подарок {name} успешно отправлен! ✨")
+
+    async def _retry(self, delivery: Dict[str, Any], error: str, delay: Optional[float] = None) -> None:
+        delivery["last_error"] = error
+        if delivery["attempts"] >= GIFT_MAX_ATTEMPTS:
+            await self._fail(delivery, error)
+            return
+
+        if delay is None:
+            delay = min(GIFT_RETRY_BASE * 2 ** (delivery["attempts"] - 1), GIFT_RETRY_MAX)
+        logging.warning(f"Gift delivery {delivery['key']} failed ({error}), retrying in {delay} s")
+        await self._save()
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, delivery["key"])
+
+    async def _fail(self, delivery: Dict[str, Any], error: str) -> None:
+        logging.error(f"Gift delivery {delivery['key']} failed: {error}")
+        delivery["last_error"] = error
+        self.failed[delivery["key"]] = self.pending.pop(delivery["key"])
+        await self._save()
+        await self._notify(
+            delivery,
+            "Не удалось отправить подарок {emoji} {name}: {error}\n"
+            "Вы можете получить подарок по ссылке:\n"
+            "tg://gift?slug={gift_id}"
+        )
+
+    async def _notify(self, delivery: Dict[str, Any], template: str) -> None:
+        gift = delivery["gift"]
+        text = template.format(
+            emoji=GIFT_EMOJIS.get(gift, "🎁"),
+            name=GIFT_NAMES.get(gift, "Подарок"),
+            error=delivery["last_error"],
+            gift_id=GIFT_IDS.get(gift)
+        )
+        try:
+            await self.bot.send_message(chat_id=delivery["chat_id"], text=text)
+        except Exception as e:
+            logging.error(f"Could not notify user {delivery['user_id']} about gift: {e}")
@@ -1,37 +1,39 @@
-import os
-import tempfile
 import logging
+from datetime import datetime
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
-from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.filters import Command, CommandObject
 
-from config import ADMIN_IDS, GIFT_EMOJIS, GIFT_NAMES
+from config import (
+    ADMIN_IDS, GIFT_EMOJIS, GIFT_NAMES, SPIN_COSTS,
+    PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
+)
 from keyboards import (
     create_admin_keyboard,
     create_back_to_admin_keyboard
 )
-from utils import is_admin, load_json_data, save_json_data
+from utils import is_admin
+from user_export import EXPORT_FORMATS, export_users
+from metrics import metrics
+from profiler import CPU_MODES, profiling
 
 admin_router = Router()
 
-def get_global_roulette_stats(roulette_stats):
+# Отрисованный текст статистики, действителен до следующего прокрута
+_stats_text_cache = {"version": None, "text": ""}
+
+def get_global_roulette_stats(storage):
     """Собирает общую статистику рулетки"""
-    total_spins = 0
-    total_spent = 0
-    total_won = 0
-    total_gifts = {}
-
-    for user_id, stats in roulette_stats.items():
-        total_spins += stats.get("total_spins", 0)
-        total_spent += stats.get("total_spent", 0)
-        total_won += stats.get("total_won", 0)
-
-        # Суммируем подарки
-        for gift, count in stats.get("gifts", {}).items():
-            if gift not in total_gifts:
-                total_gifts[gift] = 0
-            total_gifts[gift] += count
+    version = (id(storage), storage.roulette_version)
+    if _stats_text_cache["version"] == version:
+        return _stats_text_cache["text"]
+
+    totals = storage.get_global_roulette_stats()
+    total_spins = totals["total_spins"]
+    total_spent = totals["total_spent"]
+    total_won = totals["total_won"]
+    total_gifts = totals["gifts"]
 
     # Формируем список всех подарков
     gifts_text = ""
@@ -40,6 +42,16 @@ def get_global_roulette_stats(roulette_stats):
         name = GIFT_NAMES.get(gift, "Подарок")
         gifts_text += f"{emoji} {name}: {count} шт.\n"
 
+    # Статистика по типам прокрутов
+    tiers_text = ""
+    for spin_type, cost in SPIN_COSTS.items():
+        tier = totals["tiers"].get(spin_type)
+        if tier:
+            tiers_text += (
+                f"{cost} ⭐: {tier['spins']} прокрутов, получено {tier['spent']}, "
+                f"выдано на {tier['won']} звезд\n"
+            )
+
     # Вычисляем прибыль/убыток платформы
     profit = total_spent - total_won
     profit_percentage = (profit / total_spent * 100) if total_spent > 0 else 0
@@ -52,7 +64,11 @@ def get_global_roulette_stats(roulette_stats):
         f"Прибыль: {profit} звезд ({profit_percentage:.2f}%)\n\n"
         f"Выданные подарки:\n{gifts_text}"
     )
+    if tiers_text:
+        stats_text += f"\nПо типам прокрутов:\n{tiers_text}"
 
+    _stats_text_cache["version"] = version
+    _stats_text_cache["text"] = stats_text
     return stats_text
 
 @admin_router.message(Command(commands="admin"))
@@ -62,12 +78,13 @@ async def cmd_admin(message: Message):
         await message.answer("У вас нет доступа к этой команде.")
         return
 
-    # Получаем пользовательские данные из initial_data
-    users_data = message.bot.initial_data['users_data']
+    # Получаем хранилище из initial_data
+    storage = message.bot.initial_data['storage']
 
-    total_users = len(users_data)
-    active_users = sum(1 for u in users_data.values() if u.get("status") == "active")
-    removed_users = sum(1 for u in users_data.values() if u.get("status") == "removed")
+    counts = storage.get_user_counts()
+    total_users = counts["total"]
+    active_users = counts["active"]
+    removed_users = counts["removed"]
 
     admin_text = (
         "📊 <b>Админ панель</b>:\n\n"
@@ -77,9 +94,11 @@ async def cmd_admin(message: Message):
         "Выберите действие:"
     )
 
+    broadcasts = message.bot.initial_data['broadcasts']
+
     await message.answer(
         admin_text,
-        reply_markup=create_admin_keyboard(),
+        reply_markup=create_admin_keyboard(broadcasts.status),
         parse_mode="HTML"
     )
 
@@ -90,11 +109,11 @@ async def callback_roulette_stats(callback: CallbackQuery):
         await callback.answer("У вас нет доступа.", show_alert=True)
         return
 
-    # Получаем статистику рулетки из initial_data
-    roulette_stats = callback.bot.initial_data['roulette_stats']
+    # Получаем хранилище из initial_data
+    storage = callback.bot.initial_data['storage']
 
     # Собираем общую статистику
-    stats_text = get_global_roulette_stats(roulette_stats)
+    stats_text = get_global_roulette_stats(storage)
 
     await callback.message.edit_text(
         stats_text,
@@ -102,6 +121,49 @@ async def callback_roulette_stats(callback: CallbackQuery):
     )
     await callback.answer()
 
+@admin_router.callback_query(F.data == "gift_outbox")
+async def callback_gift_outbox(callback: CallbackQuery):
+    """Показать очередь доставки подарков"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    backlog = callback.bot.initial_data['gift_outbox'].backlog()
+
+    failures_text = ""
+    for delivery in backlog["recent_failures"]:
+        emoji = GIFT_EMOJIS.get(delivery["gift"], "🎁")
+        failures_text += f"{emoji} ID {delivery['user_id']}: {delivery['last_error']}\n"
+
+    outbox_text = (
+        f"🎁 Очередь подарков:\n\n"
+        f"Ожидают доставки: {backlog['pending']}\n"
+        f"Самый старый в очереди: {backlog['oldest_pending_age']} сек\n"
+        f"Доставлено: {backlog['delivered']}\n"
+        f"Не доставлено: {backlog['failed']}\n"
+    )
+    if failures_text:
+        outbox_text += f"\nПоследние ошибки:\n{failures_text}"
+
+    await callback.message.edit_text(
+        outbox_text,
+        reply_markup=create_back_to_admin_keyboard()
+    )
+    await callback.answer()
+
+@admin_router.callback_query(F.data == "bot_metrics")
+async def callback_bot_metrics(callback: CallbackQuery):
+    """Показать задержки обработчиков и счетчики запросов к API"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    await callback.message.edit_text(
+        metrics.summary(),
+        reply_markup=create_back_to_admin_keyboard()
+    )
+    await callback.answer()
+
 @admin_router.callback_query(F.data == "back_to_admin")
 async def callback_back_to_admin(callback: CallbackQuery):
     """Вернуться в админ-панель"""
@@ -112,6 +174,40 @@ async def callback_back_to_admin(callback: CallbackQuery):
     await cmd_admin(callback.message)
     await callback.answer()
 
+async def send_users_export(bot, chat_id: int, storage, caption: str, **filters) -> int:
+    """Send the user export as one or more gzip files; returns the number of users."""
+    total = 0
+    async for filename, data, rows in export_users(storage, **filters):
+        if rows == 0 and total == 0:
+            await bot.send_message(chat_id=chat_id, text="Список пользователей пуст.")
+            break
+        total += rows
+        await bot.send_document(
+            chat_id=chat_id,
+            document=BufferedInputFile(data, filename=filename),
+            caption=f"{caption} ({rows})"
+        )
+    return total
+
+def parse_export_args(args: str) -> dict:
+    """Разбирает аргументы /export: формат, status=..., from=YYYY-MM-DD, to=YYYY-MM-DD"""
+    filters = {}
+    for arg in (args or "").split():
+        key, _, value = arg.partition("=")
+        if not value and key in EXPORT_FORMATS:
+            filters["fmt"] = key
+        elif key == "status" and value:
+            filters["status"] = value
+        elif key in ("from", "to") and value:
+            try:
+                joined = int(datetime.strptime(value, "%Y-%m-%d").timestamp())
+            except ValueError:
+                raise ValueError(arg)
+            filters["joined_from" if key == "from" else "joined_to"] = joined
+        else:
+            raise ValueError(arg)
+    return filters
+
 @admin_router.callback_query(F.data == "download_users")
 async def callback_download_users(callback: CallbackQuery):
     """Download users data as a file."""
@@ -119,29 +215,115 @@ async def callback_download_users(callback: CallbackQuery):
         await callback.answer("У вас нет доступа.", show_alert=True)
         return
 
-    # Получаем пользовательские данные из initial_data
-    users_data = callback.bot.initial_data['users_data']
+    # Получаем хранилище из initial_data
+    storage = callback.bot.initial_data['storage']
 
-    lines = []
-    for user_id, info in users_data.items():
-        username = info.get("username", "Неизвестно")
-        status = info.get("status", "unknown")
-        joined_at = info.get("joined_at", "Неизвестно")
-        line = f"Имя: {username}, Статус: {status}, ID: {user_id}, Дата: {joined_at}"
-        lines.append(line)
+    await callback.answer()
+    await send_users_export(callback.bot, callback.from_user.id, storage, "Список всех пользователей")
+
+@admin_router.message(Command(commands="export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """Выгрузка пользователей с фильтрами: /export [csv|ndjson] [status=active] [from=2025-01-01] [to=2025-02-01]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+
+    try:
+        filters = parse_export_args(command.args)
+    except ValueError as e:
+        await message.answer(
+            f"Неверный аргумент: {e}\n"
+            "Использование: /export [csv|ndjson] [status=active|removed] "
+            "[from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]"
+        )
+        return
 
-    text_content = "\n".join(lines) if lines else "Список пользователей пуст."
+    storage = message.bot.initial_data['storage']
+    try:
+        await send_users_export(message.bot, message.chat.id, storage, "Пользователи", **filters)
+    except Exception as e:
+        logging.error(f"User export failed: {e}")
+        await message.answer("Не удалось выгрузить пользователей.")
 
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".txt", delete=False, encoding="utf-8") as tmp:
-        tmp.write(text_content)
-        tmp_path = tmp.name
+def parse_profile_args(args: str, modes=()) -> dict:
+    """Разбирает аргументы /profile и /memprofile: [режим] [секунды] или stop"""
+    options = {"seconds": PROFILE_DEFAULT_SECONDS}
+    for arg in (args or "").split():
+        if arg == "stop":
+            options["stop"] = True
+        elif arg in modes:
+            options["mode"] = arg
+        elif arg.isdigit() and 0 < int(arg) <= PROFILE_MAX_SECONDS:
+            options["seconds"] = int(arg)
+        else:
+            raise ValueError(arg)
+    return options
 
-    document = FSInputFile(tmp_path)
-    await callback.bot.send_document(
-        chat_id=callback.from_user.id,
-        document=document,
-        caption="Список всех пользователей"
-    )
+async def send_profile(bot, chat_id: int, window) -> None:
+    """Дождаться окончания профилирования и отправить результат админу"""
+    try:
+        filename, data, summary = await window
+    except Exception as e:
+        logging.error(f"Profiling failed: {e}")
+        await bot.send_message(chat_id=chat_id, text=f"Профилирование не удалось: {e}")
+        return
+
+    await bot.send_document(chat_id=chat_id, document=BufferedInputFile(data, filename=filename))
+    # Лимит Telegram на длину сообщения - 4096 символов
+    await bot.send_message(chat_id=chat_id, text=summary[:4000])
+
+@admin_router.message(Command(commands="profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """Профиль CPU: /profile [sampling|cprofile] [секунды], /profile stop"""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+
+    try:
+        options = parse_profile_args(command.args, CPU_MODES)
+    except ValueError as e:
+        await message.answer(
+            f"Неверный аргумент: {e}\n"
+            f"Использование: /profile [sampling|cprofile] [1-{PROFILE_MAX_SECONDS}] или /profile stop"
+        )
+        return
+
+    if options.get("stop"):
+        if not profiling.stop("cpu"):
+            await message.answer("Профилирование CPU не запущено.")
+        return
+    if profiling.running("cpu"):
+        await message.answer("Профилирование CPU уже идет, остановить: /profile stop")
+        return
+
+    mode = options.get("mode", "sampling")
+    # Окно профилирования идет в фоне, чтобы /profile stop не ждал его в очереди пользователя
+    profiling.spawn(send_profile(message.bot, message.chat.id, profiling.cpu(options["seconds"], mode)))
+    await message.answer(f"Профилирование CPU ({mode}) на {options['seconds']} с запущено.")
+
+@admin_router.message(Command(commands="memprofile"))
+async def cmd_memprofile(message: Message, command: CommandObject):
+    """Профиль памяти через tracemalloc: /memprofile [секунды], /memprofile stop"""
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет доступа к этой команде.")
+        return
+
+    try:
+        options = parse_profile_args(command.args)
+    except ValueError as e:
+        await message.answer(
+            f"Неверный аргумент: {e}\n"
+            f"Использование: /memprofile [1-{PROFILE_MAX_SECONDS}] или /memprofile stop"
+        )
+        return
+
+    if options.get("stop"):
+        if not profiling.stop("memory"):
+            await message.answer("Профилирование памяти не запущено.")
+        return
+    if profiling.running("memory"):
+        await message.answer("Профилирование памяти уже идет, остановить: /memprofile stop")
+        return
 
-    os.remove(tmp_path)
-    await callback.answer()
\ No newline at end of file
+    profiling.spawn(send_profile(message.bot, message.chat.id, profiling.memory(options["seconds"])))
+    await message.answer(f"Профилирование памяти на {options['seconds']} с запущено.")
@@ -1,116 +1,89 @@
-import logging
-import asyncio
-
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 
-from config import ADMIN_IDS
-from keyboards import create_admin_keyboard
 from utils import is_admin
+from broadcaster import estimate_duration, format_duration
 
 broadcast_router = Router()
 
-# Флаг для режима рассылки
-broadcast_mode = False
+
+class BroadcastStates(StatesGroup):
+    """States for creating a broadcast"""
+    waiting_for_message = State()
+
 
 @broadcast_router.callback_query(F.data == "create_broadcast")
-async def callback_create_broadcast(callback: CallbackQuery):
+async def callback_create_broadcast(callback: CallbackQuery, state: FSMContext):
     """Start broadcast mode."""
     if not is_admin(callback.from_user.id):
         await callback.answer("У вас нет доступа.", show_alert=True)
         return
 
-    global broadcast_mode
-    broadcast_mode = True
+    broadcasts = callback.bot.initial_data['broadcasts']
+    if broadcasts.status is not None:
+        await callback.answer("Рассылка уже идёт. Дождитесь её окончания или отмените.", show_alert=True)
+        return
+
+    await state.set_state(BroadcastStates.waiting_for_message)
 
     await callback.message.answer(
         "Отправьте сообщение, которое нужно разослать всем активным пользователям.\n\n"
         "<b>Поддерживаются:</b> \n"
-        "- <b>Текст</b> (без форматирования)\n"
-        "- <b>Фото</b> (С описанием, без форматирования)\n"
-        "- <b>Видео</b> (С описанием, без форматирования)\n"
-        "- <b>Документ</b> (С описанием, без форматирования)\n"
-        "- <b>Аудио</b> (С описанием, без форматирования)\n"
-        "- <b>Голосовое сообщение</b> (С описанием, без форматирования)\n"
-        "- <b>Видеосообщение</b>",
+        "- <b>Текст</b>\n"
+        "- <b>Фото</b> (С описанием)\n"
+        "- <b>Видео</b> (С описанием)\n"
+        "- <b>Документ</b> (С описанием)\n"
+        "- <b>Аудио</b> (С описанием)\n"
+        "- <b>Голосовое сообщение</b> (С описанием)\n"
+        "- <b>Видеосообщение</b>\n\n"
+        "Сообщение будет скопировано вместе с форматированием.",
         parse_mode="HTML"
     )
 
     await callback.answer()
 
-@broadcast_router.message()
-async def handle_broadcast(message: Message):
+@broadcast_router.message(BroadcastStates.waiting_for_message)
+async def handle_broadcast(message: Message, state: FSMContext):
     """Handle broadcast messages."""
-    global broadcast_mode
+    if not is_admin(message.from_user.id):
+        return
+
+    # Деактивируем режим рассылки
+    await state.clear()
 
-    # Проверяем, является ли пользователь администратором и активен ли режим рассылки
-    if not is_admin(message.from_user.id) or not broadcast_mode:
+    broadcasts = message.bot.initial_data['broadcasts']
+    if broadcasts.status is not None:
+        await message.answer("Рассылка уже идёт. Дождитесь её окончания или отмените.")
         return
 
-    # Получаем пользовательские данные из initial_data
-    users_data = message.bot.initial_data['users_data']
-
-    # Процесс рассылки
-    count = 0
-    errors = 0
-
-    for user_id, info in users_data.items():
-        if info.get("status") == "active":
-            try:
-                if message.photo:
-                    photo_id = message.photo[-1].file_id
-                    await message.bot.send_photo(
-                        chat_id=int(user_id),
-                        photo=photo_id,
-                        caption=message.caption or ""
-                    )
-                elif message.video:
-                    await message.bot.send_video(
-                        chat_id=int(user_id),
-                        video=message.video.file_id,
-                        caption=message.caption or ""
-                    )
-                elif message.document:
-                    await message.bot.send_document(
-                        chat_id=int(user_id),
-                        document=message.document.file_id,
-                        caption=message.caption or ""
-                    )
-                elif message.audio:
-                    await message.bot.send_audio(
-                        chat_id=int(user_id),
-                        audio=message.audio.file_id,
-                        caption=message.caption or ""
-                    )
-                elif message.voice:
-                    await message.bot.send_voice(
-                        chat_id=int(user_id),
-                        voice=message.voice.file_id,
-                        caption=message.caption or ""
-                    )
-                elif message.video_note:
-                    await message.bot.send_video_note(
-                        chat_id=int(user_id),
-                        video_note=message.video_note.file_id
-                    )
-                else:
-                    await message.bot.send_message(
-                        chat_id=int(user_id),
-                        text=message.text
-                    )
-
-                count += 1
-                # Добавляем небольшую задержку, чтобы избежать ограничений
-                await asyncio.sleep(0.05)
-            except Exception as e:
-                logging.error(f"Error sending broadcast to user {user_id}: {e}")
-                errors += 1
-
-    # Отправляем отчет об успешной рассылке
+    # Запускаем рассылку в фоне, ход рассылки отображается отдельным сообщением
+    job = await broadcasts.create(message.chat.id, message.chat.id, message.message_id)
+
     await message.answer(
-        f"Рассылка отправлена {count} пользователям. Ошибок: {errors}."
+        f"Рассылка запущена для {job.total} пользователей.\n"
+        f"Ожидаемое время: {format_duration(estimate_duration(job.total))}"
     )
 
-    # Деактивируем режим рассылки
-    broadcast_mode = False
\ No newline at end of file
+@broadcast_router.callback_query(F.data.in_({"broadcast_pause", "broadcast_resume", "broadcast_cancel"}))
+async def callback_broadcast_control(callback: CallbackQuery):
+    """Pause, resume or cancel the running broadcast."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет доступа.", show_alert=True)
+        return
+
+    broadcasts = callback.bot.initial_data['broadcasts']
+    if broadcasts.status is None:
+        await callback.answer("Нет активной рассылки.", show_alert=True)
+        return
+
+    if callback.data == "broadcast_pause":
+        broadcasts.pause()
+        await callback.answer("Рассылка приостановлена")
+    elif callback.data == "broadcast_resume":
+        broadcasts.resume()
+        await callback.answer("Рассылка продолжена")
+    else:
+        await broadcasts.cancel()
+        await callback.answer("Рассылка отменена")
@@ -1,5 +1,3 @@
-import asyncio
-import aiohttp
 import logging
 
 from aiogram import Router, F
@@ -8,8 +6,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from config import (
-    GIFT_NAMES, GIFT_EMOJIS, GIFT_IDS,
-    GIFT_VALUES, SPIN_COSTS
+    GIFT_NAMES, GIFT_EMOJIS,
+    GIFT_VALUES, SPIN_COSTS, GIFT_HOLD
 )
 from keyboards import (
     get_payment_keyboard,
@@ -21,6 +19,7 @@ from utils import (
     generate_animation_sequence,
     is_subscribed
 )
+from animation import animations
 
 
 class RouletteSpin(StatesGroup):
@@ -35,9 +34,6 @@ roulette_router = Router()
 @roulette_router.callback_query(F.data == "play_game")
 async def callback_play_game(callback: CallbackQuery, state: FSMContext):
     """Handler for 'Play Game' button"""
-    # Check subscription status
-    subscribed = await is_subscribed(callback.from_user.id, callback.bot)
-
     # Set state
     await state.set_state(RouletteSpin.selecting_bet)
 
@@ -106,46 +102,55 @@ async def success_payment_handler(message: Message, state: FSMContext):
     user_data = await state.get_data()
     spin_type = user_data.get('spin_type', 'basic')
 
-    # Get roulette stats from bot's initial data
-    roulette_stats = message.bot.initial_data['roulette_stats']
+    # Get storage and gift outbox from bot's initial data
+    storage = message.bot.initial_data['storage']
+    gift_outbox = message.bot.initial_data['gift_outbox']
+
+    # Each payment is spun and paid out exactly once
+    payment_key = message.successful_payment.telegram_payment_charge_id
+    if gift_outbox.seen(payment_key):
+        logging.warning(f"Payment {payment_key} has already been handled")
+        return
+
+    try:
+        # Determine spin result and persist the gift owed to the user;
+        # it is delivered once the user has seen the spin
+        result = spin_roulette(spin_type, message.from_user.id, storage)
+        await gift_outbox.enqueue(payment_key, message.from_user.id, message.chat.id, result, hold=GIFT_HOLD)
+    except Exception as e:
+        logging.error(f"Error in roulette spin: {e}")
+        await message.answer("Произошла ошибка при розыгрыше. Попробуйте позже.")
+        await state.clear()
+        return
 
     # Send initial roulette spinning message
     roulette_message = await message.answer("🎡 Рулетка начинает вращение...")
 
     try:
-        # Determine spin result
-        result = spin_roulette(spin_type, message.from_user.id, roulette_stats)
-
         # Generate animation sequence
         animation_sequence = generate_animation_sequence(result)
 
-        # Animate roulette spinning
-        for i, gift in enumerate(animation_sequence):
+        # Animation frames: intermediate gifts, then the final result
+        frames = []
+        for gift in animation_sequence[:-1]:
             emoji = GIFT_EMOJIS.get(gift, "🎁")
             gift_name = GIFT_NAMES.get(gift, "Подарок")
+            frames.append(f"🎡 Рулетка вращается... {emoji} {gift_name}")
+
+        emoji = GIFT_EMOJIS.get(result, "🎁")
+        gift_name = GIFT_NAMES.get(result, "Подарок")
+        frames.append(f"🎉 Результат: {emoji} {gift_name} ({GIFT_VALUES.get(result, 0)} звезд)!")
+
+        # Animate roulette spinning within the shared edit budget
+        await animations.play(roulette_message, frames)
 
-            # Update message for animation
-            if i == len(animation_sequence) - 1:
-                # Final result
-                await roulette_message.edit_text(
-                    f"🎉 Результат: {emoji} {gift_name} ({GIFT_VALUES.get(gift, 0)} звезд)!"
-                )
-            else:
-                # Intermediate animation
-                await roulette_message.edit_text(
-                    f"🎡 Рулетка вращается... {emoji} {gift_name}"
-                )
-
-                # Wait between animations
-                wait_time = 0.3 if i < len(animation_sequence) - 3 else 0.5
-                await asyncio.sleep(wait_time)
-
-        # Send gift to user
-        gift_id = GIFT_IDS.get(result)
-        await send_gift(message, gift_id, result)
+        # The gift is delivered by the outbox workers
+        await message.answer(f"Отправляю вам подарок {emoji} {gift_name}...")
+        gift_outbox.release(payment_key)
 
         # Get start keyboard
-        keyboard = await get_start_keyboard(message.from_user.id)
+        subscribed = await is_subscribed(message.from_user.id, message.bot)
+        keyboard = get_start_keyboard(subscribed)
 
         # Offer to play again
         await message.answer(
@@ -155,74 +160,8 @@ async def success_payment_handler(message: Message, state: FSMContext):
 
     except Exception as e:
         logging.error(f"Error in roulette spin: {e}")
-        await message.answer("Произошла ошибка при розыгрыше. Попробуйте позже.")
+        gift_outbox.release(payment_key)
+        await message.answer("Произошла ошибка при розыгрыше. Подарок будет отправлен автоматически.")
 
     # Clear state
     await state.clear()
-
-
-async def send_gift(message: Message, gift_id: str, gift_type: str):
-    """Send gift to user"""
-    # Retrieve user and gift details
-    user_id = message.from_user.id
-    emoji = GIFT_EMOJIS.get(gift_type, "🎁")
-    gift_name = GIFT_NAMES.get(gift_type, "Подарок")
-
-    # Initial gift sending message
-    await message.answer(f"Отправляю вам подарок {emoji} {gift_name}...")
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            # Prepare gift sending URL
-            url = f"https://api.telegram.org/bot{message.bot.token}/sendGift"
-
-            # Prepare initial parameters
-            params = {
-                "user_id": user_id,
-                "gift_id": gift_id
-            }
-
-            # First attempt to send gift
-            async with session.get(url, params=params) as response:
-                result = await response.json()
-
-                if result.get("ok"):
-                    await message.answer(f"{emoji} Подарок {gift_name} успешно отправлен! ✨")
-                    return
-
-                # Handle potential errors
-                error_description = result.get('description', 'Неизвестная ошибка')
-
-                # Try with pay_for_upgrade if first attempt fails
-                if "STARGIFT_UPGRADE_UNAVAILABLE" in error_description:
-                    params["pay_for_upgrade"] = True
-                    async with session.get(url, params=params) as pay_response:
-                        pay_result = await pay_response.json()
-
-                        if pay_result.get("ok"):
-                            await message.answer(f"{emoji} Подарок {gift_name} успешно отправлен! ✨")
-                            return
-
-                        # Handle payment upgrade errors
-                        pay_error = pay_result.get('description', 'Неизвестная ошибка')
-                        await message.answer(
-                            f"Не удалось отправить подарок: {pay_error}\n"
-                            f"Вы можете получить подарок по ссылке:\n"
-                            f"tg://gift?slug={gift_id}"
-                        )
-                else:
-                    # Handle other errors
-                    await message.answer(
-                        f"Ошибка при отправке подарка: {error_description}\n"
-                        f"Вы можете получить подарок по ссылке:\n"
-                        f"tg://gift?slug={gift_id}"
-                    )
-
-    except Exception as e:
-        # Log and handle any unexpected errors
-        logging.error(f"Gift sending error: {e}")
-        await message.answer(
-            f"Произошла ошибка при отправке подарка.\n"
-            f"Попробуйте получить его по ссылке:\n"
-            f"tg://gift?slug={gift_id}"
-        )
\ No newline at end of file
@@ -0,0 +1,15 @@
+from aiogram import Router
+from aiogram.types import ChatMemberUpdated
+
+from subscription import subscriptions
+
+subscription_router = Router()
+
+
+@subscription_router.chat_member()
+async def on_channel_member_update(event: ChatMemberUpdated):
+    """Keep the subscription cache fresh from channel membership changes."""
+    if not subscriptions.matches_chat(event.chat.username):
+        return
+
+    subscriptions.update(event.new_chat_member.user.id, event.new_chat_member.status)
@@ -46,12 +46,35 @@ def get_payment_keyboard(amount):
     return builder.as_markup()
 
 
-def create_admin_keyboard():
+def get_broadcast_control_buttons(status):
+    """Кнопки управления рассылкой в зависимости от её статуса"""
+    if status == "running":
+        return [
+            [InlineKeyboardButton(text="⏸ Приостановить рассылку", callback_data="broadcast_pause")],
+            [InlineKeyboardButton(text="⛔ Отменить рассылку", callback_data="broadcast_cancel")]
+        ]
+    if status == "paused":
+        return [
+            [InlineKeyboardButton(text="▶️ Продолжить рассылку", callback_data="broadcast_resume")],
+            [InlineKeyboardButton(text="⛔ Отменить рассылку", callback_data="broadcast_cancel")]
+        ]
+    return []
+
+
+def create_broadcast_control_keyboard(status):
+    """Создаем клавиатуру для сообщения о ходе рассылки"""
+    return InlineKeyboardMarkup(inline_keyboard=get_broadcast_control_buttons(status))
+
+
+def create_admin_keyboard(broadcast_status=None):
     """Создаем клавиатуру для admin панели"""
     inline_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📋 Скачать всех юзеров", callback_data="download_users")],
         [InlineKeyboardButton(text="💬 Создать рассылку", callback_data="create_broadcast")],
-        [InlineKeyboardButton(text="📊 Статистика рулетки", callback_data="roulette_stats")]
+        [InlineKeyboardButton(text="📊 Статистика рулетки", callback_data="roulette_stats")],
+        [InlineKeyboardButton(text="🎁 Очередь подарков", callback_data="gift_outbox")],
+        [InlineKeyboardButton(text="📈 Метрики", callback_data="bot_metrics")],
+        *get_broadcast_control_buttons(broadcast_status)
     ])
     return inline_kb
 
@@ -0,0 +1,247 @@
+import time
+import sqlite3
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
+
+from config import SQLITE_FILE, LAZY_CACHE_SIZE, LAZY_FLUSH_INTERVAL
+from sqlite_storage import SQLiteStorage
+from ledger import apply_spin
+from records import RouletteStats
+
+
+class LazyStorage(SQLiteStorage):
+    """
+    SQLite storage that keeps only recently used users in memory.
+
+    User and roulette records are read from the database on first access
+    into bounded LRU caches of ``cache_size`` entries. Changes are made in
+    the cache and written back in batches every ``flush_interval``
+    seconds; a dirty record evicted from the cache is written immediately.
+    Nothing is loaded at startup except the global roulette totals, so
+    memory and boot time depend on the number of active users rather than
+    on everyone who ever pressed /start.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE, cache_size: int = LAZY_CACHE_SIZE,
+                 flush_interval: float = LAZY_FLUSH_INTERVAL):
+        super().__init__(path)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        # user_id -> (username, status, joined_at) or None if unknown
+        self._users: "OrderedDict[int, Optional[Tuple[str, str, int]]]" = OrderedDict()
+        self._stats: "OrderedDict[int, RouletteStats]" = OrderedDict()
+        self._dirty_users: Set[int] = set()
+        self._dirty_stats: Set[int] = set()
+        self._pending_spins: List[tuple] = []
+        self._totals = super().get_global_roulette_stats()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def cached(self) -> Dict[str, int]:
+        """Cache sizes, for monitoring."""
+        return {"users": len(self._users), "stats": len(self._stats)}
+
+    # --- users ---
+
+    def _get_user(self, user_id: int) -> Optional[Tuple[str, str, int]]:
+        if user_id in self._users:
+            self._users.move_to_end(user_id)
+            return self._users[user_id]
+
+        row = self.conn.execute(
+            "SELECT username, status, joined_at FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        self._users[user_id] = row
+        self._evict_users()
+        return row
+
+    def _set_user(self, user_id: int, record: Tuple[str, str, int]) -> None:
+        self._get_user(user_id)
+        self._users[user_id] = record
+        self._dirty_users.add(user_id)
+
+    def _evict_users(self) -> None:
+        while len(self._users) > self.cache_size:
+            user_id, record = self._users.popitem(last=False)
+            if user_id in self._dirty_users:
+                try:
+                    self._write_users([(user_id, record)])
+                except sqlite3.Error as e:
+                    # Запись возвращается в кэш грязной (в конец очереди, чтобы
+                    # вытеснялись другие) и будет записана следующим flush
+                    logging.error(f"Error writing back evicted user {user_id}: {e}")
+                    self._users[user_id] = record
+                    return
+                self._dirty_users.discard(user_id)
+
+    def add_user(self, user_id: int, username: str, joined_at: datetime) -> None:
+        self._set_user(user_id, (username, "active", int(joined_at.timestamp())))
+        self._changed()
+
+    def remove_user(self, user_id: int) -> None:
+        record = self._get_user(user_id)
+        if record is not None:
+            self._set_user(user_id, (record[0], "removed", record[2]))
+            self._changed()
+
+    def get_user_counts(self) -> Dict[str, int]:
+        self.flush()
+        return super().get_user_counts()
+
+    def iter_user_batches(self, batch_size: int, status: Optional[str] = None,
+                          joined_from: Optional[int] = None,
+                          joined_to: Optional[int] = None) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+        self.flush()
+        return super().iter_user_batches(batch_size, status, joined_from, joined_to)
+
+    def iter_active_user_ids(self) -> Iterator[int]:
+        self.flush()
+        return super().iter_active_user_ids()
+
+    # --- roulette ---
+
+    def _get_stats(self, user_id: int) -> RouletteStats:
+        if user_id in self._stats:
+            self._stats.move_to_end(user_id)
+            return self._stats[user_id]
+
+        stats = RouletteStats.from_json(super().get_roulette_stats(user_id))
+        self._stats[user_id] = stats
+        self._evict_stats()
+        return stats
+
+    def _evict_stats(self) -> None:
+        while len(self._stats) > self.cache_size:
+            user_id, stats = self._stats.popitem(last=False)
+            if user_id in self._dirty_stats:
+                try:
+                    self._write_stats([(user_id, stats)])
+                except sqlite3.Error as e:
+                    logging.error(f"Error writing back evicted roulette stats of {user_id}: {e}")
+                    self._stats[user_id] = stats
+                    return
+                self._dirty_stats.discard(user_id)
+
+    def get_roulette_stats(self, user_id: int) -> Dict[str, Any]:
+        return self._get_stats(user_id).to_json()
+
+    def record_spin(self, user_id: int, spin_type: str, result: str,
+                    cost: int, value: int, spins_without_win: int) -> None:
+        self._get_stats(user_id)
+        record = {
+            "user": user_id,
+            "spin_type": spin_type,
+            "result": result,
+            "cost": cost,
+            "value": value,
+            "pity": spins_without_win,
+            "ts": int(time.time())
+        }
+        apply_spin(self._stats, self._totals, record)
+        self._dirty_stats.add(user_id)
+        self._pending_spins.append(tuple(record.values()))
+        self.roulette_version += 1
+        self._changed()
+
+    def get_global_roulette_stats(self) -> Dict[str, Any]:
+        return self._totals
+
+    # --- write-back ---
+
+    def _changed(self) -> None:
+        if self._task is None:
+            # Not started (scripts, shutdown): write through
+            self.flush()
+
+    def _write_users(self, records) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (id, username, status, joined_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "username = excluded.username, status = excluded.status, joined_at = excluded.joined_at",
+                ((user_id, *record) for user_id, record in records)
+            )
+
+    def _write_stats(self, records) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO roulette_stats "
+                "(user_id, total_spins, spins_without_win, total_spent, total_won) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (user_id, s.total_spins, s.spins_without_win, s.total_spent, s.total_won)
+                    for user_id, s in records
+                )
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO roulette_gifts (user_id, gift, count) VALUES (?, ?, ?)",
+                (
+                    (user_id, gift, count)
+                    for user_id, s in records for gift, count in s.gift_counts().items()
+                )
+            )
+
+    def flush(self) -> None:
+        """Write every dirty record, pending spins and the totals in one go."""
+        if not (self._dirty_users or self._dirty_stats or self._pending_spins):
+            return
+
+        users = [(user_id, self._users[user_id]) for user_id in self._dirty_users]
+        stats = [(user_id, self._stats[user_id]) for user_id in self._dirty_stats]
+        spins, self._pending_spins = self._pending_spins, []
+        self._dirty_users.clear()
+        self._dirty_stats.clear()
+
+        try:
+            self._write_users(users)
+            self._write_stats(stats)
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO spins (user_id, spin_type, result, cost, value, pity, ts) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    spins
+                )
+                self._write_totals()
+        except Exception as e:
+            logging.error(f"Error flushing lazy storage: {e}")
+            self._dirty_users.update(user_id for user_id, _ in users)
+            self._dirty_stats.update(user_id for user_id, _ in stats)
+            self._pending_spins = spins + self._pending_spins
+
+    def _write_totals(self) -> None:
+        totals = self._totals
+        self.conn.execute(
+            "INSERT OR REPLACE INTO roulette_totals (id, total_spins, total_spent, total_won) "
+            "VALUES (1, ?, ?, ?)",
+            (totals["total_spins"], totals["total_spent"], totals["total_won"])
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_gift_totals (gift, count) VALUES (?, ?)",
+            totals["gifts"].items()
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_tier_totals (spin_type, spins, spent, won) VALUES (?, ?, ?, ?)",
+            (
+                (spin_type, tier["spins"], tier["spent"], tier["won"])
+                for spin_type, tier in totals["tiers"].items()
+            )
+        )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+        await super().close()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
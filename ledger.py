@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import asyncio
+import itertools
+import logging
+from typing import Dict, Any, Iterator, Optional
+
+from config import (
+    LEDGER_FILE, STATS_SNAPSHOT_FILE, STATS_FILE,
+    LEDGER_COMPACT_INTERVAL, STATS_BINARY_SNAPSHOT_FILE, BINARY_SNAPSHOTS
+)
+from persistence import (
+    load_json_data, load_json_or_snapshot, write_file_atomic,
+    dump_json, pack_snapshot, write_snapshot
+)
+from records import GIFT_CATALOG, RouletteStats, stats_tuple_to_json
+
+
+def new_roulette_stats() -> Dict[str, Any]:
+    """Empty per-user roulette statistics record."""
+    return {
+        "total_spins": 0,
+        "spins_without_win": 0,
+        "total_spent": 0,
+        "total_won": 0,
+        "gifts": {}
+    }
+
+
+def new_roulette_totals() -> Dict[str, Any]:
+    """Empty global roulette aggregates."""
+    return {
+        "total_spins": 0,
+        "total_spent": 0,
+        "total_won": 0,
+        "gifts": {},
+        "tiers": {}
+    }
+
+
+def build_roulette_totals(roulette_stats: Dict[int, RouletteStats]) -> Dict[str, Any]:
+    """
+    Rebuild global aggregates from per-user statistics.
+
+    Per-user statistics do not keep the spin type, so per-tier counts
+    start empty; only snapshots written by the ledger carry them.
+    """
+    totals = new_roulette_totals()
+    for stats in roulette_stats.values():
+        totals["total_spins"] += stats.total_spins
+        totals["total_spent"] += stats.total_spent
+        totals["total_won"] += stats.total_won
+        for gift, count in stats.gift_counts().items():
+            totals["gifts"][gift] = totals["gifts"].get(gift, 0) + count
+    return totals
+
+
+def load_roulette_stats(data: Dict[str, Any]) -> Dict[int, RouletteStats]:
+    """Per-user statistics from a JSON object or a binary snapshot."""
+    return {int(user_id): RouletteStats.load(stats) for user_id, stats in data.items()}
+
+
+def apply_spin(roulette_stats: Dict[int, RouletteStats], totals: Dict[str, Any],
+               record: Dict[str, Any]) -> None:
+    """Apply one ledger record to the per-user statistics and global aggregates."""
+    result, cost, value = record["result"], record["cost"], record["value"]
+
+    stats = roulette_stats.get(record["user"])
+    if stats is None:
+        stats = roulette_stats[record["user"]] = RouletteStats()
+    stats.add_spin(result, cost, value, record["pity"])
+
+    totals["total_spins"] += 1
+    totals["total_spent"] += cost
+    totals["total_won"] += value
+    totals["gifts"][result] = totals["gifts"].get(result, 0) + 1
+    tier = totals["tiers"].setdefault(record["spin_type"], {"spins": 0, "spent": 0, "won": 0})
+    tier["spins"] += 1
+    tier["spent"] += cost
+    tier["won"] += value
+
+
+def snapshot_json(offset: int, rows: Dict[int, tuple], totals: Dict[str, Any],
+                  batch: int = 1000) -> Iterator[str]:
+    """
+    Snapshot file text in chunks of ``batch`` players.
+
+    One ``dump_json`` of all players holds the GIL until it is done; small
+    chunks let the event loop run while a worker thread serializes.
+    """
+    yield f'{{"ledger_offset":{offset},"roulette_stats":{{'
+    items = iter(rows.items())
+    separator = ""
+    while True:
+        chunk = ",".join(
+            f'"{user_id}":{dump_json(stats_tuple_to_json(row))}'
+            for user_id, row in itertools.islice(items, batch)
+        )
+        if not chunk:
+            break
+        yield separator + chunk
+        separator = ","
+    yield f'}},"totals":{dump_json(totals)}}}'
+
+
+class SpinLedger:
+    """
+    Append-only log of spins with periodic snapshot compaction.
+
+    Every spin appends one line to ``LEDGER_FILE``. The aggregate statistics
+    are rebuilt from the latest snapshot plus the ledger tail written after
+    it. The ledger itself is never truncated and serves as the payout audit
+    trail.
+    """
+
+    def __init__(self, path: str = LEDGER_FILE, snapshot_path: str = STATS_SNAPSHOT_FILE,
+                 compact_interval: float = LEDGER_COMPACT_INTERVAL,
+                 binary_snapshot_path: str = STATS_BINARY_SNAPSHOT_FILE):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.binary_snapshot_path = binary_snapshot_path
+        self.compact_interval = compact_interval
+        self.roulette_stats: Dict[int, RouletteStats] = {}
+        self.totals: Dict[str, Any] = new_roulette_totals()
+        self.snapshot_offset = 0
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+        self._compact_lock = asyncio.Lock()
+        # Пока идет компактизация: user_id -> статистика на момент её начала
+        # для игроков, изменившихся с тех пор
+        self._frozen: Optional[Dict[int, tuple]] = None
+
+    @property
+    def offset(self) -> int:
+        """Byte offset of the end of the ledger written so far."""
+        return self._file.tell() if self._file is not None else self.snapshot_offset
+
+    def load(self) -> Dict[int, RouletteStats]:
+        """Rebuild statistics from the snapshot and replay the ledger tail."""
+        if os.path.exists(self.snapshot_path):
+            # Подарки в снимке - байты счётчиков по индексам GIFT_CATALOG
+            snapshot, _ = load_json_or_snapshot(self.snapshot_path, self.binary_snapshot_path,
+                                                schema=list(GIFT_CATALOG))
+            self.roulette_stats = load_roulette_stats(snapshot.get("roulette_stats", {}))
+            self.snapshot_offset = snapshot.get("ledger_offset", 0)
+            self.totals = snapshot.get("totals") or build_roulette_totals(self.roulette_stats)
+        else:
+            # No snapshot yet: start from the legacy stats file
+            self.roulette_stats = load_roulette_stats(load_json_data(STATS_FILE))
+            self.snapshot_offset = 0
+            self.totals = build_roulette_totals(self.roulette_stats)
+
+        replayed = 0
+        end = self.snapshot_offset
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                f.seek(self.snapshot_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Torn write from a crash, drop it
+                        break
+                    try:
+                        apply_spin(self.roulette_stats, self.totals, json.loads(line))
+                    except (ValueError, KeyError) as e:
+                        logging.error(f"Skipping bad ledger record at offset {end}: {e}")
+                    end += len(line)
+                    replayed += 1
+
+            if end < os.path.getsize(self.path):
+                with open(self.path, "r+b") as f:
+                    f.truncate(end)
+
+        logging.info(f"Replayed {replayed} spins from {self.path}")
+        return self.roulette_stats
+
+    def append(self, user_id: int, spin_type: str, result: str,
+               cost: int, value: int, pity: int) -> Dict[str, Any]:
+        """Append a spin to the ledger and apply it to the statistics."""
+        if self._file is None:
+            self._file = open(self.path, "ab")
+
+        record = {
+            "user": user_id,
+            "spin_type": spin_type,
+            "result": result,
+            "cost": cost,
+            "value": value,
+            "pity": pity,
+            "ts": int(time.time())
+        }
+        self._file.write(dump_json(record).encode("utf-8") + b"\n")
+        self._file.flush()
+        if self._frozen is not None and user_id not in self._frozen:
+            stats = self.roulette_stats.get(user_id)
+            if stats is not None:
+                self._frozen[user_id] = stats.to_tuple()
+        apply_spin(self.roulette_stats, self.totals, record)
+        return record
+
+    async def compact(self) -> None:
+        """Write a snapshot covering everything in the ledger so far."""
+        if self._file is None or self.offset == self.snapshot_offset:
+            return
+
+        async with self._compact_lock:
+            # On the loop: the offset, the list of players and a copy of the
+            # totals. Players changed while the worker thread serializes are
+            # frozen by append() first, so the snapshot matches the offset.
+            offset = self.offset
+            players = dict(self.roulette_stats)
+            totals = json.loads(json.dumps(self.totals))
+            self._frozen = {}
+            try:
+                await asyncio.to_thread(os.fsync, self._file.fileno())
+                await asyncio.to_thread(self._write_snapshot, offset, players, totals, self._frozen)
+                self.snapshot_offset = offset
+            except Exception as e:
+                logging.error(f"Error writing snapshot {self.snapshot_path}: {e}")
+            finally:
+                self._frozen = None
+
+    def _write_snapshot(self, offset: int, players: Dict[int, RouletteStats], totals: Dict[str, Any],
+                        frozen: Dict[int, tuple]) -> None:
+        """Serialize and write the snapshots; runs in a worker thread."""
+        rows = {}
+        for user_id, stats in players.items():
+            # Сначала живая запись, потом замороженная: append() замораживает
+            # игрока до изменения, так что одна из них всегда до offset
+            row = stats.to_tuple()
+            rows[user_id] = frozen.get(user_id, row)
+
+        write_file_atomic(self.snapshot_path, snapshot_json(offset, rows, totals))
+        if BINARY_SNAPSHOTS:
+            packed = pack_snapshot({"ledger_offset": offset, "roulette_stats": rows, "totals": totals})
+            write_snapshot(self.binary_snapshot_path, self.snapshot_path, packed, schema=list(GIFT_CATALOG))
+
+    def start(self) -> None:
+        """Start the periodic compaction job."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop compaction, write a final snapshot and close the ledger."""
+        if self._task is not None:
+            # Не отменять посреди записи снимка
+            async with self._compact_lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.compact()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            await self.compact()
@@ -1,45 +1,224 @@
+import signal
 import asyncio
 import logging
+import secrets
+from typing import Any, Dict, Set
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, HTTP_POOL_SIZE, HTTP_TIMEOUT, RUN_MODE,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+)
 from utils import load_initial_data
+from fsm_storage import SQLiteFSMStorage
+from middlewares import UserLaneMiddleware
+from metrics import metrics, setup_handler_metrics, ApiMetricsMiddleware, start_metrics_server
+from rate_limiter import RateLimiter
+from persistence import write_behind
+from broadcaster import BroadcastManager
+from gift_outbox import GiftOutbox
 from handlers.start import start_router
 from handlers.admin import admin_router
 from handlers.roulette import roulette_router
 from handlers.broadcast import broadcast_router
+from handlers.subscription import subscription_router
 
-async def main():
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher with every router of the bot."""
+    storage = SQLiteFSMStorage()
+    dp = Dispatcher(storage=storage)
 
-    # Load initial data
-    initial_data = load_initial_data()
+    # Updates of one user are handled in order, different users in parallel
+    lanes = UserLaneMiddleware()
+    dp.update.outer_middleware(lanes)
+    metrics.gauge("bot_user_lanes_active", "Users with updates in flight.", lambda: lanes.active)
 
-    # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    # Latency of every handler, see metrics.py
+    setup_handler_metrics(dp)
 
     # Register routers
     dp.include_routers(
         start_router,
         admin_router,
         roulette_router,
-        broadcast_router
+        broadcast_router,
+        subscription_router
     )
+    return dp
+
 
+def setup_services(bot: Bot, initial_data: dict) -> None:
+    """Attach storage and background services to the bot."""
     # Attach initial data to bot
     bot.initial_data = initial_data
 
+    # Background broadcast jobs, resumed after a restart
+    broadcasts = BroadcastManager(bot, initial_data["storage"])
+    broadcasts.load()
+    initial_data["broadcasts"] = broadcasts
+
+    # Durable queue of gifts owed to users, delivered in the background
+    gift_outbox = GiftOutbox(bot)
+    gift_outbox.load()
+    initial_data["gift_outbox"] = gift_outbox
+
+    # Every outgoing request goes through one rate limiter; metrics sit
+    # inside it, so they count each attempt actually sent to Telegram
+    rate_limiter = RateLimiter()
+    bot.session.middleware(rate_limiter)
+    bot.session.middleware(ApiMetricsMiddleware())
+    metrics.gauge("bot_api_queued", "Requests waiting for the rate limiter.", lambda: rate_limiter.queued)
+    metrics.gauge("bot_gift_outbox_pending", "Gifts waiting for delivery.", lambda: len(gift_outbox.pending))
+    metrics.gauge("bot_gift_outbox_failed", "Gifts that could not be delivered.", lambda: len(gift_outbox.failed))
+    storage = initial_data["storage"]
+    if hasattr(storage, "cached"):
+        metrics.gauge("bot_storage_cached_users", "Users held in the storage cache.",
+                      lambda: storage.cached["users"])
+
+
+async def run_polling(dp: Dispatcher, bot: Bot) -> None:
+    # A webhook left over from webhook mode blocks getUpdates
+    await bot.delete_webhook()
+
+    # Start polling; chat_member updates must be requested explicitly
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """
+    Acknowledges every update at once and handles it in a background task.
+
+    The tasks are kept in ``tasks``; on shutdown ``close()`` waits for
+    them and leaves the bot session open for the rest of the shutdown.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=False, **kwargs)
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=self.bot.session.json_loads)
+        task = asyncio.create_task(self._feed_update(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({}, dumps=self.bot.session.json_dumps)
+
+    async def _feed_update(self, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    async def close(self) -> None:
+        # Let updates already acknowledged to Telegram finish
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Serve updates from Telegram over HTTPS webhook.
+
+    Requests without the secret token are rejected. Every update is
+    acknowledged right away and handled in a background task, so slow
+    handlers (the roulette animation) never delay Telegram's delivery.
+    Runs until SIGTERM or SIGINT, then lets those tasks finish.
+    """
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    app = web.Application()
+    handler = WebhookHandler(dispatcher=dp, bot=bot, secret_token=secret)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+    logging.info(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # docker stop шлёт SIGTERM: без обработчика процесс завершится, минуя finally
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signals = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            # Windows
+            pass
+
+    try:
+        await stop.wait()
+        logging.info("Stopping webhook")
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        # Stops accepting updates, then WebhookHandler.close waits for the running ones
+        await runner.cleanup()
+
+
+async def main():
+    # Configure logging
+    logging.basicConfig(level=logging.INFO)
+
+    # Load initial data
+    initial_data = load_initial_data()
+
+    # Initialize bot and dispatcher; one pooled HTTP session serves
+    # every API call, including gift delivery
+    session = AiohttpSession(limit=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT)
+    bot = Bot(token=BOT_TOKEN, session=session)
+    dp = create_dispatcher()
+    setup_services(bot, initial_data)
+    broadcasts = initial_data["broadcasts"]
+    gift_outbox = initial_data["gift_outbox"]
+
+    # Persist data changes in the background
+    write_behind.start()
+    initial_data["storage"].start()
+    dp.storage.start()
+    broadcasts.start()
+    gift_outbox.start()
+    metrics_runner = None
+
     try:
-        # Start polling
-        await dp.start_polling(bot)
+        try:
+            metrics_runner = await start_metrics_server()
+        except OSError as e:
+            # Занятый порт метрик не должен мешать работе бота
+            logging.error(f"Could not start metrics server: {e}")
+
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await run_polling(dp, bot)
     except Exception as e:
         logging.error(f"An error occurred: {e}")
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+        # Flush pending data changes
+        await broadcasts.close()
+        await gift_outbox.close()
+        await initial_data["storage"].close()
+        await dp.storage.close()
+        await write_behind.close()
+
         # Close bot session
         await bot.session.close()
 
@@ -0,0 +1,244 @@
+import time
+import bisect
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import TelegramObject
+
+from config import METRICS_HOST, METRICS_PORT
+
+
+# Границы бакетов гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, as Prometheus exposes it."""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        # Последний бакет - всё, что больше LATENCY_BUCKETS[-1]
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile (inf past the last one)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    In-process counters of handler latency and Telegram API calls.
+
+    Handlers are timed by ``HandlerMetricsMiddleware``, API calls are
+    counted by ``ApiMetricsMiddleware`` on the bot session. Gauges are
+    callables read at render time (queue sizes, caches). Everything is
+    rendered in the Prometheus text format by ``render()`` and as a short
+    summary for the admin panel by ``summary()``.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.handler_latency: Dict[str, Histogram] = {}
+        self.handler_errors: Dict[str, int] = {}
+        self.api_latency: Dict[str, Histogram] = {}
+        self.api_errors: Dict[str, int] = {}
+        self.api_retry_after: Dict[str, int] = {}
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def observe_handler(self, name: str, elapsed: float, failed: bool = False) -> None:
+        histogram = self.handler_latency.get(name)
+        if histogram is None:
+            histogram = self.handler_latency[name] = Histogram()
+        histogram.observe(elapsed)
+        if failed:
+            self.handler_errors[name] = self.handler_errors.get(name, 0) + 1
+
+    def observe_api(self, method: str, elapsed: float, error: Optional[Exception] = None) -> None:
+        histogram = self.api_latency.get(method)
+        if histogram is None:
+            histogram = self.api_latency[method] = Histogram()
+        histogram.observe(elapsed)
+        if isinstance(error, TelegramRetryAfter):
+            self.api_retry_after[method] = self.api_retry_after.get(method, 0) + 1
+        elif error is not None:
+            self.api_errors[method] = self.api_errors.get(method, 0) + 1
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """Register a value read on every render."""
+        self.gauges[name] = (help_text, read)
+
+    def read_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, (_, read) in self.gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                logging.error(f"Error reading metric {name}: {e}")
+        return values
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        def histograms(name: str, help_text: str, label: str, data: Dict[str, Histogram]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(data.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+
+        def counters(name: str, help_text: str, label: str, data: Dict[str, int]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(data.items()):
+                lines.append(f'{name}{{{label}="{key}"}} {value}')
+
+        histograms("bot_handler_seconds", "Handler latency.", "handler", self.handler_latency)
+        counters("bot_handler_errors_total", "Handlers that raised.", "handler", self.handler_errors)
+        histograms("bot_api_request_seconds", "Telegram Bot API call latency.", "method", self.api_latency)
+        counters("bot_api_errors_total", "Failed Telegram Bot API calls.", "method", self.api_errors)
+        counters("bot_api_retry_after_total", "Telegram Bot API calls rejected with 429.",
+                 "method", self.api_retry_after)
+
+        values = self.read_gauges()
+        for name, (help_text, _) in self.gauges.items():
+            if name in values:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {values[name]}")
+
+        lines.append("# HELP bot_start_time_seconds Process start time.")
+        lines.append("# TYPE bot_start_time_seconds gauge")
+        lines.append(f"bot_start_time_seconds {self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 8) -> str:
+        """Короткая сводка для админ-панели"""
+        def ms(value: Optional[float]) -> str:
+            if value is None:
+                return "-"
+            return f">{LATENCY_BUCKETS[-1]:g}с" if value == float("inf") else f"≤{value * 1000:g}мс"
+
+        uptime = int(time.time() - self.started_at)
+        text = f"📈 Метрики за {uptime // 3600} ч {uptime % 3600 // 60} мин\n\n"
+
+        busiest = sorted(self.handler_latency.items(), key=lambda x: x[1].count, reverse=True)[:top]
+        if busiest:
+            text += "Обработчики (вызовов, p50, p95, ошибок):\n"
+            for name, histogram in busiest:
+                text += (
+                    f"{name}: {histogram.count}, {ms(histogram.quantile(0.5))}, "
+                    f"{ms(histogram.quantile(0.95))}, {self.handler_errors.get(name, 0)}\n"
+                )
+
+        api_calls = sum(histogram.count for histogram in self.api_latency.values())
+        text += (
+            f"\nЗапросов к API: {api_calls}\n"
+            f"Ошибок API: {sum(self.api_errors.values())}\n"
+            f"Ответов 429: {sum(self.api_retry_after.values())}\n"
+        )
+        busiest = sorted(self.api_latency.items(), key=lambda x: x[1].count, reverse=True)[:top]
+        for method, histogram in busiest:
+            text += f"{method}: {histogram.count}, p95 {ms(histogram.quantile(0.95))}\n"
+
+        values = self.read_gauges()
+        if values:
+            text += "\n" + "".join(f"{name}: {value:g}\n" for name, value in values.items())
+        return text
+
+
+metrics = Metrics()
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Times every handler call; register as an inner middleware."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", type(event).__name__)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            metrics.observe_handler(name, time.perf_counter() - started, failed)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Counts outgoing Bot API calls by method, with errors and 429s."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            # Сетевые ошибки и таймауты тоже считаются ошибками API
+            metrics.observe_api(method.__api_method__, time.perf_counter() - started, e)
+            raise
+        metrics.observe_api(method.__api_method__, time.perf_counter() - started)
+        return response
+
+
+def setup_handler_metrics(dp) -> None:
+    """Time the handlers of every event type of ``dp`` and its routers."""
+    # Внутренние middleware диспетчера действуют и во вложенных роутерах
+    middleware = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(middleware)
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Serve ``GET /metrics`` on a local port; returns None when disabled (port 0)."""
+    if not port:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=metrics.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logging.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
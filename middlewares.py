@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class UserLaneMiddleware(BaseMiddleware):
+    """
+    Runs updates of one user strictly one after another.
+
+    Every user gets a lane (a FIFO ``asyncio.Lock``) while they have updates
+    in flight; updates of different users run in parallel. Lanes are
+    dropped as soon as they are idle, so memory stays proportional to the
+    number of users currently being served.
+    """
+
+    def __init__(self):
+        # user_id -> [lock, updates waiting or running]
+        self._lanes: Dict[int, List[Any]] = {}
+
+    @property
+    def active(self) -> int:
+        """Users with updates in flight."""
+        return len(self._lanes)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        lane = self._lanes.get(user.id)
+        if lane is None:
+            lane = self._lanes[user.id] = [asyncio.Lock(), 0]
+        lane[1] += 1
+        try:
+            async with lane[0]:
+                return await handler(event, data)
+        finally:
+            lane[1] -= 1
+            if not lane[1]:
+                del self._lanes[user.id]
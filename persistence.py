@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import marshal
+import asyncio
+import logging
+import tempfile
+from typing import Dict, Any, Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # optional, marshal is used instead
+    msgpack = None
+
+from config import FLUSH_INTERVAL_MS, FLUSH_MAX_CHANGES, BINARY_SNAPSHOTS
+
+SNAPSHOT_MAGIC = b"BOTSNAP1"
+
+
+def load_json_data(filename: str) -> dict:
+    """Load data from a JSON file."""
+    if os.path.exists(filename):
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                return data
+        except Exception as e:
+            logging.error(f"Error reading file {filename}: {e}")
+    return {}
+
+
+def write_file_atomic(filename: str, payload: Union[str, bytes, Iterable[str]]) -> None:
+    """
+    Write text or bytes to a temp file next to the target and rename it over the target.
+
+    ``payload`` may also be an iterable of text chunks, written as they are produced.
+    """
+    directory = os.path.dirname(filename) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        if isinstance(payload, bytes):
+            f = os.fdopen(fd, "wb")
+        else:
+            f = os.fdopen(fd, "w", encoding="utf-8")
+        with f:
+            if isinstance(payload, (str, bytes)):
+                f.write(payload)
+            else:
+                f.writelines(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def encode_record(obj: Any) -> Any:
+    """JSON form of in-memory records (anything with ``to_json``)."""
+    if hasattr(obj, "to_json"):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(data: Any) -> str:
+    """Serialize data in the compact form used for on-disk files."""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=encode_record)
+
+
+def write_json_atomic(filename: str, data: Any) -> None:
+    """Serialize ``data`` and write it atomically; safe to run in a worker thread."""
+    write_file_atomic(filename, dump_json(data))
+
+
+def source_signature(filename: str) -> Optional[list]:
+    """``[mtime_ns, size]`` of a file, None if it does not exist."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def pack_snapshot(data: Any) -> Tuple[str, bytes]:
+    """Serialize JSON-compatible data with msgpack if installed, marshal otherwise."""
+    if msgpack is not None:
+        return "msgpack", msgpack.packb(data, use_bin_type=True)
+    return "marshal", marshal.dumps(data)
+
+
+def write_snapshot(filename: str, source: str, packed: Tuple[str, bytes], schema: Any = None,
+                   signature: Optional[list] = None) -> None:
+    """
+    Write a binary snapshot of the data stored in the JSON file ``source``.
+
+    Call it right after ``source`` has been written: the snapshot records the
+    file's mtime and size and is only used while they still match. When the
+    data is packed elsewhere (on the event loop), pass the ``signature`` of
+    ``source`` taken together with it, so a later rewrite of ``source`` is
+    not mistaken for the packed data.
+    ``schema`` describes how the packed values are laid out (e.g. the order
+    of array slots); a snapshot with a different schema is not loaded.
+    """
+    fmt, payload = packed
+    header = json.dumps({
+        "format": fmt,
+        "python": list(sys.version_info[:2]),
+        "source": signature if signature is not None else source_signature(source),
+        "schema": schema
+    }).encode("utf-8")
+    write_file_atomic(filename, SNAPSHOT_MAGIC + header + b"\n" + payload)
+
+
+def load_snapshot(filename: str, source: str, schema: Any = None) -> Optional[Any]:
+    """Data from a binary snapshot, or None if it is missing, stale or unreadable."""
+    try:
+        with open(filename, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            header = json.loads(f.readline())
+            if header["source"] != source_signature(source):
+                return None
+            if header.get("schema") != schema:
+                logging.info(f"Ignoring snapshot {filename} written for another data layout")
+                return None
+            if header["format"] == "msgpack" and msgpack is not None:
+                return msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+            if header["format"] == "marshal" and header["python"] == list(sys.version_info[:2]):
+                return marshal.loads(f.read())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Ignoring snapshot {filename}: {e}")
+    return None
+
+
+def load_json_or_snapshot(filename: str, snapshot: str, schema: Any = None) -> Tuple[dict, bool]:
+    """
+    Load a JSON data file, from its binary snapshot when that is fresh.
+
+    Returns the data and whether the snapshot was used.
+    """
+    if BINARY_SNAPSHOTS:
+        data = load_snapshot(snapshot, filename, schema)
+        if data is not None:
+            return data, True
+    return load_json_data(filename), False
+
+
+class WriteBehindStore:
+    """
+    Coalesces writes of JSON data files.
+
+    Mutations only mark a file as dirty; a background task writes dirty files
+    at most every ``flush_interval`` seconds, or sooner once ``max_changes``
+    mutations have piled up. Until the store is started (scripts, tests) every
+    mutation is written synchronously, as before.
+    """
+
+    def __init__(self, flush_interval: float, max_changes: int):
+        self.flush_interval = flush_interval
+        self.max_changes = max_changes
+        self._dirty: Dict[str, Any] = {}
+        self._changes = 0
+        self._has_dirty = asyncio.Event()
+        self._threshold = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def mark_dirty(self, filename: str, data: Any) -> None:
+        """Schedule ``data`` to be written to ``filename``."""
+        if not self.running:
+            try:
+                write_json_atomic(filename, data)
+            except Exception as e:
+                logging.error(f"Error writing to file {filename}: {e}")
+            return
+
+        self._dirty[filename] = data
+        self._changes += 1
+        self._has_dirty.set()
+        if self._changes >= self.max_changes:
+            self._threshold.set()
+
+    def start(self) -> None:
+        """Start the background flush task on the running loop."""
+        if self._task is None:
+            # Bind the synchronization primitives to the current loop
+            self._has_dirty = asyncio.Event()
+            self._threshold = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        """Write every dirty file now."""
+        async with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._changes = 0
+            self._has_dirty.clear()
+            self._threshold.clear()
+
+            unwritten = dict(dirty)
+            try:
+                for filename, data in dirty.items():
+                    try:
+                        # Копия верхнего уровня снимается на loop, сериализация
+                        # (секунды на миллионе пользователей) идет в потоке.
+                        # Записи меняются только заменой атрибутов, поэтому
+                        # каждая из них сериализуется целой.
+                        snapshot = dict(data) if isinstance(data, dict) else data
+                        await asyncio.to_thread(write_json_atomic, filename, snapshot)
+                    except Exception as e:
+                        logging.error(f"Error writing to file {filename}: {e}")
+                    else:
+                        del unwritten[filename]
+            finally:
+                # Не записанное (ошибка или отмена) вернется в следующий flush;
+                # более новые данные, отмеченные за это время, важнее
+                for filename, data in unwritten.items():
+                    self._dirty.setdefault(filename, data)
+                if self._dirty:
+                    self._has_dirty.set()
+
+    async def close(self) -> None:
+        """Stop the background task and flush whatever is still dirty."""
+        if self._task is not None:
+            # Под блокировкой задача не может быть посреди flush: отмена
+            # застанет её только в ожидании
+            async with self._lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            await self.flush()
+            # Отмеченное во время последнего flush; дальше запись синхронная
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_dirty.wait()
+            try:
+                await asyncio.wait_for(self._threshold.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+write_behind = WriteBehindStore(
+    flush_interval=FLUSH_INTERVAL_MS / 1000,
+    max_changes=FLUSH_MAX_CHANGES
+)
@@ -0,0 +1,248 @@
+import io
+import os
+import sys
+import time
+import pstats
+import signal
+import marshal
+import asyncio
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from config import PROFILE_SAMPLE_INTERVAL_MS, PROFILE_TOP, PROFILE_TRACEMALLOC_FRAMES
+
+
+CPU_MODES = ("sampling", "cprofile")
+
+
+def frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Sampling CPU profiler of the event loop thread.
+
+    Every ``interval`` seconds of CPU time a ``SIGPROF`` timer interrupts
+    the loop and the current stack is counted; idle time in ``select`` is
+    not sampled. Handlers run unchanged, so the cost is one stack walk per
+    sample and nothing at all when stopped.
+
+    Without ``signal.setitimer`` (Windows) or outside the main thread a
+    daemon thread reads the loop's stack instead, with the interpreter
+    switch interval lowered so it does not only see the loop in ``select``.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._use_signal = (
+            hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+        )
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._previous = None
+        # Имена функций кэшируются по объекту кода
+        self._names: Dict[object, str] = {}
+
+    def start(self) -> None:
+        if self._use_signal:
+            self._previous = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            return
+
+        self._previous = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._previous, self.interval / 5))
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        if self._use_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self._previous)
+        else:
+            self._stop.set()
+            self._thread.join()
+            sys.setswitchinterval(self._previous)
+        return self.stacks
+
+    def _sample(self, frame) -> None:
+        names = self._names
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            name = names.get(code)
+            if name is None:
+                name = names[code] = frame_name(code)
+            stack.append(name)
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def _on_signal(self, signum, frame) -> None:
+        self._sample(frame)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample(sys._current_frames().get(self._thread_id))
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """Stacks in the collapsed format of flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_frames(stacks: Counter, top: int = PROFILE_TOP) -> str:
+    """Functions by share of samples: on top of the stack (self) and anywhere in it (total)."""
+    total = sum(stacks.values())
+    if not total:
+        return "Нет сэмплов"
+
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+
+    lines = [f"Сэмплов: {total}", "self%  total%  функция"]
+    for name, count in own.most_common(top):
+        lines.append(f"{count * 100 / total:5.1f}  {inclusive[name] * 100 / total:6.1f}  {name}")
+    return "\n".join(lines)
+
+
+def memory_report(snapshot: tracemalloc.Snapshot, top: int = PROFILE_TOP) -> str:
+    """Top allocation sites of memory still held at the end of the window."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics("lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [f"Выделено и не освобождено: {total / 1024:.1f} KiB в {len(stats)} местах"]
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"{stat.size / 1024:9.1f} KiB  {stat.count:7}  "
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return "\n".join(lines)
+
+
+class Profiling:
+    """
+    Bounded profiling windows started by admins.
+
+    At most one CPU and one memory window run at a time. A window ends
+    after its duration or on ``stop()``; the caller gets
+    ``(filename, data, summary)`` to send back. While no window is
+    running, nothing is hooked into the bot.
+    """
+
+    def __init__(self):
+        self._stops: Dict[str, asyncio.Event] = {}
+        self._tasks = set()
+
+    def running(self, kind: str) -> bool:
+        return kind in self._stops
+
+    def stop(self, kind: str) -> bool:
+        """End a running window early; False if there was none."""
+        event = self._stops.get(kind)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def spawn(self, coro) -> None:
+        """Run a window in the background, keeping a reference to its task."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @contextmanager
+    def _window(self, kind: str):
+        """Reserve the ``kind`` window before any profiler is hooked in."""
+        if kind in self._stops:
+            raise RuntimeError(f"{kind} profiling is already running")
+        self._stops[kind] = asyncio.Event()
+        try:
+            yield
+        finally:
+            del self._stops[kind]
+
+    async def _wait(self, kind: str, seconds: float) -> float:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._stops[kind].wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        return time.monotonic() - started
+
+    async def cpu(self, seconds: float, mode: str = "sampling") -> Tuple[str, bytes, str]:
+        """
+        Profile the event loop thread for ``seconds``.
+
+        ``sampling`` returns collapsed stacks for flame graphs; ``cprofile``
+        traces every call (noticeably slower while it runs) and returns a
+        pstats file for ``python -m pstats`` or snakeviz.
+        """
+        if mode not in CPU_MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        if mode == "sampling":
+            sampler = StackSampler()
+            with self._window("cpu"):
+                sampler.start()
+                try:
+                    elapsed = await self._wait("cpu", seconds)
+                finally:
+                    stacks = sampler.stop()
+            summary = f"CPU за {elapsed:.1f} с (sampling)\n{top_frames(stacks)}"
+            return f"cpu_{stamp}.collapsed", collapsed_stacks(stacks).encode("utf-8"), summary
+
+        profile = cProfile.Profile()
+        with self._window("cpu"):
+            profile.enable()
+            try:
+                elapsed = await self._wait("cpu", seconds)
+            finally:
+                profile.disable()
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        # Тот же формат, что пишет Stats.dump_stats
+        data = marshal.dumps(stats.stats)
+        summary = f"CPU за {elapsed:.1f} с (cProfile)\n{out.getvalue()}"
+        return f"cpu_{stamp}.prof", data, summary
+
+    async def memory(self, seconds: float) -> Tuple[str, bytes, str]:
+        """Trace allocations for ``seconds`` and report where the memory still held came from."""
+        if tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is already tracing")
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        with self._window("memory"):
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            try:
+                elapsed = await self._wait("memory", seconds)
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        title = f"Память за {elapsed:.1f} с, пик {peak / 1024:.1f} KiB\n"
+        report = title + memory_report(snapshot, top=500) + "\n"
+        return f"memory_{stamp}.txt", report.encode("utf-8"), title + memory_report(snapshot)
+
+
+profiling = Profiling()
@@ -0,0 +1,194 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple, Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    API_RATE, API_BURST, API_CHAT_RATE, API_CHAT_BURST, API_GROUP_RATE, API_GROUP_BURST,
+    API_MAX_RETRIES, API_MAX_RETRY_WAIT
+)
+
+
+# Классы приоритета: меньше - раньше
+PAYMENT, INTERACTIVE, ANIMATION, BROADCAST = range(4)
+
+# Priority of requests made in the current task; None means by method
+request_priority: ContextVar[Optional[int]] = ContextVar("request_priority", default=None)
+
+PAYMENT_METHODS = {"sendInvoice", "createInvoiceLink", "answerPreCheckoutQuery", "sendGift", "refundStarPayment"}
+
+# Методы, отправляющие сообщения: на них действуют лимиты Telegram
+LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+# Правки не считаются в лимите чата: анимация сама держит интервал между кадрами
+CHAT_LIMITED_PREFIXES = ("send", "copy", "forward")
+
+
+class RateLimiter(BaseRequestMiddleware):
+    """
+    Shapes every outgoing Bot API request of the bot.
+
+    Messages to one chat are limited to ``chat_rate`` per second
+    (``group_rate`` for groups and channels). Bulk sends (the ``BROADCAST``
+    class) also wait for a global token bucket of ``rate`` per second.
+    Replies to users, payments, gifts and animation frames never wait for
+    it, but every one of them spends a token, down to ``-burst``: while
+    users are being answered, broadcasts slow down instead of the replies.
+    Reads such as ``getChatMember`` and ``getUpdates`` are not delayed.
+
+    A 429 pauses all limited requests for ``retry_after`` seconds and the
+    request is sent again, up to ``max_retries`` times. Animation frames are
+    not retried: the animation skips them instead.
+    """
+
+    def __init__(self, rate: float = API_RATE, burst: float = API_BURST,
+                 chat_rate: float = API_CHAT_RATE, chat_burst: float = API_CHAT_BURST,
+                 group_rate: float = API_GROUP_RATE, group_burst: float = API_GROUP_BURST,
+                 max_retries: int = API_MAX_RETRIES, max_retry_wait: float = API_MAX_RETRY_WAIT):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # (priority, order, future) of requests waiting for a token
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        # chat_id -> [tokens, updated]; tokens below zero are already promised
+        self._chats: Dict[Union[int, str], List[float]] = {}
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a global token."""
+        return len(self._waiters)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all limited requests for ``seconds``."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        priority = request_priority.get()
+        if priority is None:
+            priority = PAYMENT if name in PAYMENT_METHODS else INTERACTIVE
+        limited = name.startswith(LIMITED_PREFIXES)
+        chat_id = getattr(method, "chat_id", None) if name.startswith(CHAT_LIMITED_PREFIXES) else None
+
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._acquire_chat(chat_id)
+            if limited and priority == BROADCAST:
+                await self._acquire(priority)
+            elif limited:
+                await self._spend()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if limited:
+                    self.pause(e.retry_after)
+                attempt += 1
+                if priority == ANIMATION or attempt > self.max_retries or e.retry_after > self.max_retry_wait:
+                    raise
+                logging.warning(f"{name} hit flood limit, retrying in {e.retry_after} s")
+                if not limited:
+                    await asyncio.sleep(e.retry_after)
+
+    # --- global bucket ---
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def _spend(self) -> None:
+        """Take a token without waiting for one; only a 429 pause holds the request."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            await asyncio.sleep(self._paused_until - now)
+            now = time.monotonic()
+        self._refill(now)
+        # Долг ограничен: после всплеска ответов рассылка ждёт не дольше burst / rate
+        self._tokens = max(self._tokens - 1, -self.burst)
+
+    async def _acquire(self, priority: int) -> None:
+        if not self._waiters and self._take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже выдан, но не использован
+                self._tokens += 1
+            raise
+
+    def _schedule(self) -> None:
+        if self._wakeup is not None or not self._waiters:
+            return
+        now = time.monotonic()
+        delay = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._grant)
+
+    def _grant(self) -> None:
+        self._wakeup = None
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._take():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._schedule()
+
+    # --- per-chat buckets ---
+
+    async def _acquire_chat(self, chat_id: Union[int, str]) -> None:
+        # Группы и каналы (отрицательный ID или @username) медленнее личных чатов
+        private = isinstance(chat_id, int) and chat_id > 0
+        rate, burst = (self.chat_rate, self.chat_burst) if private else (self.group_rate, self.group_burst)
+
+        now = time.monotonic()
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= 10_000:
+                self._forget_idle_chats(now)
+            state = self._chats[chat_id] = [burst, now]
+        tokens = min(burst, state[0] + (now - state[1]) * rate)
+        # Токен резервируется сразу, поэтому одновременные запросы встают в очередь
+        state[0], state[1] = tokens - 1, now
+        if tokens < 1:
+            await asyncio.sleep((1 - tokens) / rate)
+
+    def _forget_idle_chats(self, now: float) -> None:
+        """Drop chats idle for a minute: their buckets are full again, as for a new chat."""
+        self._chats = {
+            chat_id: state for chat_id, state in self._chats.items() if now - state[1] < 60
+        }
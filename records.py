@@ -0,0 +1,265 @@
+"""
+Compact in-memory records for users and roulette statistics.
+
+The JSON files keep their shape (objects keyed by user ID); in memory every
+user is a ``UserRecord`` and every player a ``RouletteStats`` with an
+array-backed gift counter, keyed by int user ID.
+
+Normalize existing data files (epoch ``joined_at``, no empty gift counts):
+
+    python records.py
+
+Once the stats snapshot exists, the legacy stats file is no longer read and
+is left alone.
+"""
+import os
+import sys
+import json
+import logging
+import tempfile
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from config import GIFT_VALUES, USERS_FILE, STATS_FILE, STATS_SNAPSHOT_FILE
+
+
+# Порядок подарков задаёт индексы в счётчиках RouletteStats.gifts
+GIFT_CATALOG: Tuple[str, ...] = tuple(GIFT_VALUES)
+GIFT_INDEX: Dict[str, int] = {gift: i for i, gift in enumerate(GIFT_CATALOG)}
+# Подарки из сохранённой статистики, которых больше нет в каталоге (предупреждаем один раз)
+_unknown_gifts: Set[str] = set()
+
+
+@lru_cache(maxsize=65536)
+def _hour_epoch(prefix: str) -> int:
+    """Epoch of a local "dd.mm.YYYY HH" hour (DST changes happen on whole hours)."""
+    return int(datetime.strptime(prefix, "%d.%m.%Y %H").timestamp())
+
+
+def parse_joined_at(value: Any) -> Optional[int]:
+    """Convert a stored ``joined_at`` (epoch or "dd.mm.YYYY HH:MM:SS") to epoch seconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        # Быстрый путь для старых файлов: час переводится в epoch один раз
+        if len(value) == 19 and value[2] == "." and value[5] == "." and value[13] == ":":
+            return _hour_epoch(value[:13]) + int(value[14:16]) * 60 + int(value[17:19])
+        return int(datetime.strptime(value, "%d.%m.%Y %H:%M:%S").timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+class UserRecord:
+    """A user: display name, "active"/"removed" status and join time (epoch seconds)."""
+
+    __slots__ = ("username", "status", "joined_at")
+
+    def __init__(self, username: str, status: str = "active", joined_at: Optional[int] = None):
+        self.username = username
+        # Одна строка статуса на всех пользователей
+        self.status = sys.intern(status)
+        self.joined_at = joined_at
+
+    @classmethod
+    def from_json(cls, info: Dict[str, Any]) -> "UserRecord":
+        return cls(
+            info.get("username"),
+            info.get("status", "active"),
+            parse_joined_at(info.get("joined_at"))
+        )
+
+    @classmethod
+    def load_all(cls, data: Dict[Any, Any]) -> Dict[int, "UserRecord"]:
+        """All users of a JSON object or a snapshot, keyed by int ID."""
+        # Формат определяется один раз, а не для каждого пользователя
+        if data and not isinstance(next(iter(data.values())), dict):
+            return {int(user_id): cls(*value) for user_id, value in data.items()}
+        return {int(user_id): cls.from_json(info) for user_id, info in data.items()}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"username": self.username, "status": self.status, "joined_at": self.joined_at}
+
+    def to_tuple(self) -> tuple:
+        return self.username, self.status, self.joined_at
+
+
+class RouletteStats:
+    """Roulette statistics of one user; ``gifts[GIFT_INDEX[gift]]`` counts won gifts."""
+
+    __slots__ = ("total_spins", "spins_without_win", "total_spent", "total_won", "gifts")
+
+    def __init__(self, total_spins: int = 0, spins_without_win: int = 0,
+                 total_spent: int = 0, total_won: int = 0, gifts: Optional[array] = None):
+        self.total_spins = total_spins
+        self.spins_without_win = spins_without_win
+        self.total_spent = total_spent
+        self.total_won = total_won
+        self.gifts = gifts if gifts is not None else array("I", bytes(4 * len(GIFT_CATALOG)))
+
+    @classmethod
+    def from_json(cls, stats: Dict[str, Any]) -> "RouletteStats":
+        record = cls(
+            stats.get("total_spins", 0),
+            stats.get("spins_without_win", 0),
+            stats.get("total_spent", 0),
+            stats.get("total_won", 0)
+        )
+        for gift, count in stats.get("gifts", {}).items():
+            index = GIFT_INDEX.get(gift)
+            if index is None:
+                if gift not in _unknown_gifts:
+                    _unknown_gifts.add(gift)
+                    logging.warning(f"Ignoring unknown gift {gift} in roulette stats")
+                continue
+            record.gifts[index] = count
+        return record
+
+    @classmethod
+    def load(cls, value: Any) -> "RouletteStats":
+        """From a JSON object or a snapshot tuple."""
+        if isinstance(value, dict):
+            return cls.from_json(value)
+        *counters, gifts = value
+        return cls(*counters, array("I", gifts))
+
+    def add_spin(self, result: str, cost: int, value: int, pity: int) -> None:
+        self.total_spins += 1
+        self.total_spent += cost
+        self.total_won += value
+        self.gifts[GIFT_INDEX[result]] += 1
+        self.spins_without_win = pity
+
+    def gift_counts(self) -> Dict[str, int]:
+        """Won gifts by name, without the ones never won."""
+        return {GIFT_CATALOG[i]: count for i, count in enumerate(self.gifts) if count}
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "total_spins": self.total_spins,
+            "spins_without_win": self.spins_without_win,
+            "total_spent": self.total_spent,
+            "total_won": self.total_won,
+            "gifts": self.gift_counts()
+        }
+
+    def to_tuple(self) -> tuple:
+        return (self.total_spins, self.spins_without_win, self.total_spent,
+                self.total_won, self.gifts.tobytes())
+
+
+def stats_tuple_to_json(row: tuple) -> Dict[str, Any]:
+    """JSON form of ``RouletteStats.to_tuple()`` without building a record."""
+    gifts = array("I", row[4])
+    return {
+        "total_spins": row[0],
+        "spins_without_win": row[1],
+        "total_spent": row[2],
+        "total_won": row[3],
+        "gifts": {GIFT_CATALOG[i]: count for i, count in enumerate(gifts) if count}
+    }
+
+
+def iter_json_object(filename: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, Any]]:
+    """
+    Yield the ``(key, value)`` pairs of a top-level JSON object one by one.
+
+    Only one member is decoded at a time, so files far larger than memory
+    can be processed.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        pos = 0
+
+        def skip(chars: str) -> str:
+            """Skip whitespace and return the next significant character."""
+            nonlocal buffer, pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buffer):
+                    char = buffer[pos]
+                    if char not in chars:
+                        raise ValueError(f"Expected one of {chars!r} at {pos}, got {char!r}")
+                    pos += 1
+                    return char
+                more = f.read(chunk_size)
+                if not more:
+                    raise ValueError("Unexpected end of file")
+                buffer, pos = buffer[pos:] + more, 0
+
+        def decode() -> Any:
+            nonlocal buffer, pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # A number at the end of the buffer may continue in the next chunk
+                    if end < len(buffer):
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    pass
+                more = f.read(chunk_size)
+                if not more:
+                    value, pos = decoder.raw_decode(buffer, pos)
+                    return value
+                buffer, pos = buffer[pos:] + more, 0
+
+        skip("{")
+        while pos < len(buffer) and buffer[pos] in " \t\r\n":
+            pos += 1
+        if buffer[pos:pos + 1] == "}":
+            return
+        while True:
+            key = decode()
+            skip(":")
+            yield key, decode()
+            if skip(",}") == "}":
+                return
+
+
+def migrate_file(filename: str, record_type) -> int:
+    """Rewrite a JSON object of records in normalized form, one member at a time."""
+    if not os.path.exists(filename):
+        return 0
+
+    directory = os.path.dirname(filename) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    count = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            out.write("{")
+            for key, value in iter_json_object(filename):
+                record = record_type.from_json(value)
+                out.write("," if count else "")
+                out.write(json.dumps(str(int(key))) + ":")
+                out.write(json.dumps(record.to_json(), ensure_ascii=False, separators=(",", ":")))
+                count += 1
+            out.write("}")
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+if __name__ == "__main__":
+    users = migrate_file(USERS_FILE, UserRecord)
+    logging.info(f"Normalized {users} users in {USERS_FILE}")
+    if os.path.exists(STATS_SNAPSHOT_FILE):
+        # Статистика читается из снимка и журнала спинов, а снимок бот пишет
+        # уже из RouletteStats - stats.json больше не загружается
+        logging.warning(f"Not migrating {STATS_FILE}: roulette stats are loaded from {STATS_SNAPSHOT_FILE}, "
+                        f"which is already written in normalized form")
+    else:
+        stats = migrate_file(STATS_FILE, RouletteStats)
+        logging.info(f"Normalized {stats} roulette stats in {STATS_FILE}")
@@ -0,0 +1,191 @@
+import random
+import logging
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional, draw_batch falls back to a Python loop
+    np = None
+
+
+# Множители удачи по числу спинов без выигрыша
+BOOST_FACTORS = (1.0, 2.0, 3.0)
+
+
+def get_boost_factor(spins_without_win: int) -> float:
+    """Определяет множитель удачи по счетчику неудачных спинов"""
+    if spins_without_win >= 5:
+        return 3.0  # Значительно увеличиваем шансы
+    if spins_without_win >= 4:
+        return 2.0  # Умеренно увеличиваем шансы
+    return 1.0
+
+
+def get_probabilities(spin_type: str, boost_factor: float) -> Dict[str, float]:
+    """Таблица вероятностей (веса) для типа спина и множителя удачи"""
+    if spin_type == "basic":  # 25 звезд
+        return {
+            "heart": 70 / boost_factor,
+            "bear": 25 / boost_factor,
+            "rose": 4.5 * boost_factor,
+            "cake": 0.5 * boost_factor,
+            "bouquet": 0,
+            "rocket": 0,
+            "trophy": 0,
+            "ring": 0,
+            "diamond": 0
+        }
+    elif spin_type == "standard":  # 50 звезд
+        return {
+            "heart": 40 / boost_factor,
+            "bear": 30 / boost_factor,
+            "rose": 20,  # Не меняем этот шанс
+            "cake": 3 * boost_factor,
+            "bouquet": 3 * boost_factor,
+            "rocket": 3 * boost_factor,
+            "trophy": 0.9 * boost_factor,
+            "ring": 0.09 * boost_factor,
+            "diamond": 0.01 * boost_factor
+        }
+    else:  # premium - 100 звезд
+        return {
+            "heart": 20 / boost_factor,
+            "bear": 20 / boost_factor,
+            "rose": 30 / boost_factor,
+            "cake": 8 * boost_factor,
+            "bouquet": 8 * boost_factor,
+            "rocket": 8 * boost_factor,
+            "champagne": 4 * boost_factor,
+            "trophy": 1.5 * boost_factor,
+            "ring": 0.4 * boost_factor,
+            "diamond": 0.1 * boost_factor
+        }
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table for O(1) weighted draws.
+
+    ``prob[i]`` is the chance to keep column ``i``; otherwise the draw
+    falls through to ``alias[i]``. Zero-weight items are left out.
+    """
+
+    def __init__(self, weights: Dict[str, float]):
+        self.items: List[str] = [item for item, weight in weights.items() if weight > 0]
+        total = sum(weights[item] for item in self.items)
+        n = len(self.items)
+
+        self.probabilities = {item: weights[item] / total for item in self.items}
+        self.prob: List[float] = [0.0] * n
+        self.alias: List[int] = [0] * n
+
+        scaled = [weights[item] * n / total for item in self.items]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = g
+            scaled[g] = scaled[g] + scaled[s] - 1.0
+            (small if scaled[g] < 1.0 else large).append(g)
+
+        # Остатки равны 1 с точностью до округления
+        for i in small + large:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+
+        if np is not None:
+            self._np_prob = np.array(self.prob)
+            self._np_alias = np.array(self.alias, dtype=np.intp)
+            self._np_items = np.array(self.items, dtype=object)
+
+    def implied_probabilities(self) -> Dict[str, float]:
+        """Exact chance of every item under ``prob`` and ``alias``."""
+        n = len(self.items)
+        result = dict.fromkeys(self.items, 0.0)
+        for i, item in enumerate(self.items):
+            result[item] += self.prob[i] / n
+            result[self.items[self.alias[i]]] += (1.0 - self.prob[i]) / n
+        return result
+
+    def draw(self, rng: random.Random = random) -> str:
+        """One weighted draw."""
+        u = rng.random() * len(self.items)
+        i = int(u)
+        return self.items[i] if u - i < self.prob[i] else self.items[self.alias[i]]
+
+    def draw_batch(self, n: int, rng: random.Random = random) -> List[str]:
+        """
+        ``n`` independent weighted draws at once.
+
+        With numpy the draws are vectorized, seeded from ``rng`` so a seeded
+        ``rng`` still gives reproducible results.
+        """
+        size = len(self.items)
+        if np is not None:
+            u = np.random.default_rng(rng.getrandbits(64)).random(n) * size
+            i = u.astype(np.intp)
+            picked = np.where(u - i < self._np_prob[i], i, self._np_alias[i])
+            return self._np_items[picked].tolist()
+
+        items, prob = self.items, self.prob
+        fallback = [items[a] for a in self.alias]
+        result = []
+        for u in [rng.random() * size for _ in range(n)]:
+            i = int(u)
+            result.append(items[i] if u - i < prob[i] else fallback[i])
+        return result
+
+
+# Таблицы компилируются один раз при импорте
+SPIN_TABLES: Dict[Tuple[str, float], AliasTable] = {
+    (spin_type, boost_factor): AliasTable(get_probabilities(spin_type, boost_factor))
+    for spin_type in ("basic", "standard", "premium")
+    for boost_factor in BOOST_FACTORS
+}
+
+
+def get_table(spin_type: str, spins_without_win: int) -> AliasTable:
+    """Alias table for a spin type and pity counter."""
+    if spin_type not in ("basic", "standard"):
+        spin_type = "premium"
+    return SPIN_TABLES[(spin_type, get_boost_factor(spins_without_win))]
+
+
+def draw(spin_type: str, spins_without_win: int) -> str:
+    """Результат одного спина"""
+    return get_table(spin_type, spins_without_win).draw()
+
+
+def draw_batch(spin_type: str, spins_without_win: int, n: int) -> List[str]:
+    """Результаты ``n`` спинов с одинаковым счетчиком неудачных спинов"""
+    return get_table(spin_type, spins_without_win).draw_batch(n)
+
+
+def check_distributions(rel_tolerance: float = 1e-9) -> None:
+    """
+    Check that every alias table gives exactly the configured odds.
+
+    The chances implied by ``prob`` and ``alias`` are compared with the
+    weights relative to each gift's own chance, so rare gifts are checked
+    as strictly as common ones. Raises ValueError on a mismatch.
+    """
+    for (spin_type, boost_factor), table in SPIN_TABLES.items():
+        weights = get_probabilities(spin_type, boost_factor)
+        total = sum(weights.values())
+        implied = table.implied_probabilities()
+        for gift, weight in weights.items():
+            expected = weight / total
+            actual = implied.get(gift, 0.0)
+            if abs(actual - expected) > rel_tolerance * expected:
+                raise ValueError(
+                    f"{spin_type} x{boost_factor} {gift}: expected {expected:.6g}, got {actual:.6g}"
+                )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    check_distributions()
+    logging.info("Alias tables match the configured odds")
@@ -0,0 +1,339 @@
+import json
+import time
+import sqlite3
+import pathlib
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from config import (
+    SQLITE_FILE, USERS_FILE, REFERRALS_FILE,
+    CREDITED_REFERRALS_FILE
+)
+from persistence import load_json_data
+from storage import Storage, new_roulette_stats
+from ledger import SpinLedger
+from records import parse_joined_at
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    status TEXT NOT NULL DEFAULT 'active',
+    joined_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_users_status ON users (status);
+CREATE INDEX IF NOT EXISTS idx_users_joined_at ON users (joined_at);
+
+CREATE TABLE IF NOT EXISTS roulette_stats (
+    user_id INTEGER PRIMARY KEY,
+    total_spins INTEGER NOT NULL DEFAULT 0,
+    spins_without_win INTEGER NOT NULL DEFAULT 0,
+    total_spent INTEGER NOT NULL DEFAULT 0,
+    total_won INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS roulette_gifts (
+    user_id INTEGER NOT NULL,
+    gift TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, gift)
+);
+CREATE INDEX IF NOT EXISTS idx_roulette_gifts_gift ON roulette_gifts (gift, count);
+
+CREATE TABLE IF NOT EXISTS roulette_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_spins INTEGER NOT NULL DEFAULT 0,
+    total_spent INTEGER NOT NULL DEFAULT 0,
+    total_won INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS roulette_gift_totals (
+    gift TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS roulette_tier_totals (
+    spin_type TEXT PRIMARY KEY,
+    spins INTEGER NOT NULL DEFAULT 0,
+    spent INTEGER NOT NULL DEFAULT 0,
+    won INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS spins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    spin_type TEXT NOT NULL,
+    result TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    pity INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_spins_user_id ON spins (user_id);
+
+CREATE TABLE IF NOT EXISTS referrals (
+    key TEXT PRIMARY KEY,
+    data TEXT
+);
+
+CREATE TABLE IF NOT EXISTS credited_referrals (
+    key TEXT PRIMARY KEY
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage backend on an SQLite database in WAL mode.
+
+    Long scans (exports, broadcast lists) read through a separate read-only
+    connection: each sees one consistent snapshot while writes keep being
+    committed on ``conn``.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self._read_conn: Optional[sqlite3.Connection] = None
+
+    def _reader(self) -> sqlite3.Connection:
+        if self._read_conn is None:
+            uri = pathlib.Path(self.path).resolve().as_uri() + "?mode=ro"
+            self._read_conn = sqlite3.connect(uri, uri=True)
+        return self._read_conn
+
+    def add_user(self, user_id: int, username: str, joined_at: datetime) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO users (id, username, status, joined_at) VALUES (?, ?, 'active', ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "username = excluded.username, status = 'active', joined_at = excluded.joined_at",
+                (user_id, username, int(joined_at.timestamp()))
+            )
+
+    def remove_user(self, user_id: int) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE users SET status = 'removed' WHERE id = ?", (user_id,))
+
+    def get_user_counts(self) -> Dict[str, int]:
+        counts = {"total": 0, "active": 0, "removed": 0}
+        for status, count in self.conn.execute(
+            "SELECT status, COUNT(*) FROM users GROUP BY status"
+        ):
+            counts[status] = count
+            counts["total"] += count
+        return counts
+
+    def iter_user_batches(self, batch_size: int, status: Optional[str] = None,
+                          joined_from: Optional[int] = None,
+                          joined_to: Optional[int] = None) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+        # Фильтры идут в WHERE: выборку делают idx_users_status и idx_users_joined_at
+        conditions, params = [], []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if joined_from is not None:
+            conditions.append("joined_at >= ?")
+            params.append(joined_from)
+        if joined_to is not None:
+            conditions.append("joined_at < ?")
+            params.append(joined_to)
+        query = "SELECT id, username, status, joined_at FROM users"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        cursor = self._reader().execute(query, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [
+                    (user_id, {"username": username, "status": user_status, "joined_at": joined_at})
+                    for user_id, username, user_status, joined_at in rows
+                ]
+        finally:
+            # Брошенный экспорт не должен держать снимок и мешать checkpoint
+            cursor.close()
+
+    def iter_active_user_ids(self) -> Iterator[int]:
+        cursor = self._reader().execute("SELECT id FROM users WHERE status = 'active'")
+        try:
+            for (user_id,) in cursor:
+                yield user_id
+        finally:
+            cursor.close()
+
+    def get_roulette_stats(self, user_id: int) -> Dict[str, Any]:
+        stats = new_roulette_stats()
+        row = self.conn.execute(
+            "SELECT total_spins, spins_without_win, total_spent, total_won "
+            "FROM roulette_stats WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return stats
+
+        stats["total_spins"], stats["spins_without_win"], \
+            stats["total_spent"], stats["total_won"] = row
+        stats["gifts"] = dict(self.conn.execute(
+            "SELECT gift, count FROM roulette_gifts WHERE user_id = ?", (user_id,)
+        ))
+        return stats
+
+    def record_spin(self, user_id: int, spin_type: str, result: str,
+                    cost: int, value: int, spins_without_win: int) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO roulette_stats "
+                "(user_id, total_spins, spins_without_win, total_spent, total_won) "
+                "VALUES (?, 1, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "total_spins = total_spins + 1, "
+                "spins_without_win = excluded.spins_without_win, "
+                "total_spent = total_spent + excluded.total_spent, "
+                "total_won = total_won + excluded.total_won",
+                (user_id, spins_without_win, cost, value)
+            )
+            self.conn.execute(
+                "INSERT INTO roulette_gifts (user_id, gift, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (user_id, gift) DO UPDATE SET count = count + 1",
+                (user_id, result)
+            )
+            self.conn.execute(
+                "INSERT INTO spins (user_id, spin_type, result, cost, value, pity, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, spin_type, result, cost, value, spins_without_win, int(time.time()))
+            )
+
+            # Running aggregates, so global stats never scan per-user rows
+            self.conn.execute(
+                "INSERT INTO roulette_totals (id, total_spins, total_spent, total_won) "
+                "VALUES (1, 1, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET "
+                "total_spins = total_spins + 1, "
+                "total_spent = total_spent + excluded.total_spent, "
+                "total_won = total_won + excluded.total_won",
+                (cost, value)
+            )
+            self.conn.execute(
+                "INSERT INTO roulette_gift_totals (gift, count) VALUES (?, 1) "
+                "ON CONFLICT (gift) DO UPDATE SET count = count + 1",
+                (result,)
+            )
+            self.conn.execute(
+                "INSERT INTO roulette_tier_totals (spin_type, spins, spent, won) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (spin_type) DO UPDATE SET "
+                "spins = spins + 1, spent = spent + excluded.spent, won = won + excluded.won",
+                (spin_type, cost, value)
+            )
+        self.roulette_version += 1
+
+    def get_global_roulette_stats(self) -> Dict[str, Any]:
+        row = self.conn.execute(
+            "SELECT total_spins, total_spent, total_won FROM roulette_totals WHERE id = 1"
+        ).fetchone()
+        total_spins, total_spent, total_won = row or (0, 0, 0)
+        gifts = dict(self.conn.execute("SELECT gift, count FROM roulette_gift_totals"))
+        tiers = {
+            spin_type: {"spins": spins, "spent": spent, "won": won}
+            for spin_type, spins, spent, won in self.conn.execute(
+                "SELECT spin_type, spins, spent, won FROM roulette_tier_totals"
+            )
+        }
+        return {
+            "total_spins": total_spins,
+            "total_spent": total_spent,
+            "total_won": total_won,
+            "gifts": gifts,
+            "tiers": tiers
+        }
+
+    async def close(self) -> None:
+        if self._read_conn is not None:
+            self._read_conn.close()
+            self._read_conn = None
+        self.conn.close()
+
+
+def import_json_files(storage: SQLiteStorage) -> None:
+    """One-shot import of the JSON data files into an SQLite database."""
+    users_data = load_json_data(USERS_FILE)
+    referral_data = load_json_data(REFERRALS_FILE)
+    credited_referrals = load_json_data(CREDITED_REFERRALS_FILE).get("credited", [])
+    ledger = SpinLedger()
+    roulette_stats = ledger.load()
+    totals = ledger.totals
+
+    with storage.conn:
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO users (id, username, status, joined_at) VALUES (?, ?, ?, ?)",
+            (
+                (int(user_id), info.get("username"), info.get("status", "active"),
+                 parse_joined_at(info.get("joined_at")))
+                for user_id, info in users_data.items()
+            )
+        )
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO referrals (key, data) VALUES (?, ?)",
+            ((str(key), json.dumps(value, ensure_ascii=False)) for key, value in referral_data.items())
+        )
+        storage.conn.executemany(
+            "INSERT OR IGNORE INTO credited_referrals (key) VALUES (?)",
+            ((str(key),) for key in credited_referrals)
+        )
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_stats "
+            "(user_id, total_spins, spins_without_win, total_spent, total_won) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                (user_id, stats.total_spins, stats.spins_without_win,
+                 stats.total_spent, stats.total_won)
+                for user_id, stats in roulette_stats.items()
+            )
+        )
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_gifts (user_id, gift, count) VALUES (?, ?, ?)",
+            (
+                (user_id, gift, count)
+                for user_id, stats in roulette_stats.items()
+                for gift, count in stats.gift_counts().items()
+            )
+        )
+        storage.conn.execute(
+            "INSERT OR REPLACE INTO roulette_totals (id, total_spins, total_spent, total_won) "
+            "VALUES (1, ?, ?, ?)",
+            (totals["total_spins"], totals["total_spent"], totals["total_won"])
+        )
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_gift_totals (gift, count) VALUES (?, ?)",
+            totals["gifts"].items()
+        )
+        storage.conn.executemany(
+            "INSERT OR REPLACE INTO roulette_tier_totals (spin_type, spins, spent, won) "
+            "VALUES (?, ?, ?, ?)",
+            (
+                (spin_type, tier["spins"], tier["spent"], tier["won"])
+                for spin_type, tier in totals["tiers"].items()
+            )
+        )
+
+    logging.info(
+        f"Imported {len(users_data)} users, {len(referral_data)} referrals, "
+        f"{len(credited_referrals)} credited referrals, {len(roulette_stats)} roulette stats "
+        f"into {storage.path}"
+    )
+
+
+if __name__ == "__main__":
+    # python sqlite_storage.py -- import the JSON files into SQLITE_FILE
+    sqlite_storage = SQLiteStorage()
+    import_json_files(sqlite_storage)
+    asyncio.run(sqlite_storage.close())
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Set, Any, Iterator, List, Tuple, Optional
+
+from config import USERS_FILE, USERS_SNAPSHOT_FILE, BINARY_SNAPSHOTS
+from persistence import write_behind, pack_snapshot, write_snapshot, source_signature
+from ledger import SpinLedger, new_roulette_stats
+from records import UserRecord
+
+
+class Storage:
+    """
+    Storage backend for users and roulette statistics.
+
+    Handlers never touch the underlying data directly; they go through
+    the functions in ``utils``, which call into the configured backend.
+    """
+
+    # Bumped on every spin so callers can cache derived views
+    roulette_version = 0
+
+    def add_user(self, user_id: int, username: str, joined_at: datetime) -> None:
+        """Add or update a user and mark them active."""
+        raise NotImplementedError
+
+    def remove_user(self, user_id: int) -> None:
+        """Mark a user as removed."""
+        raise NotImplementedError
+
+    def get_user_counts(self) -> Dict[str, int]:
+        """Number of users per status, plus the ``total``."""
+        raise NotImplementedError
+
+    def iter_user_batches(self, batch_size: int, status: Optional[str] = None,
+                          joined_from: Optional[int] = None,
+                          joined_to: Optional[int] = None) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Yield lists of ``(user_id, info)`` of users matching the filters.
+
+        ``status`` selects one status, ``joined_from <= joined_at < joined_to``
+        (epoch seconds) a join window. Every list covers at most
+        ``batch_size`` scanned users and may be empty, so a caller on the
+        event loop can yield between lists even when few users match.
+        """
+        raise NotImplementedError
+
+    def iter_active_user_ids(self) -> Iterator[int]:
+        """Yield IDs of users with the ``active`` status."""
+        raise NotImplementedError
+
+    def get_roulette_stats(self, user_id: int) -> Dict[str, Any]:
+        """Roulette statistics of a single user."""
+        raise NotImplementedError
+
+    def record_spin(self, user_id: int, spin_type: str, result: str,
+                    cost: int, value: int, spins_without_win: int) -> None:
+        """Apply one spin to the user's statistics."""
+        raise NotImplementedError
+
+    def get_global_roulette_stats(self) -> Dict[str, Any]:
+        """Totals over all users: spins, spent, won, per-gift and per-tier counts."""
+        raise NotImplementedError
+
+    def start(self) -> None:
+        """Start background jobs of the backend."""
+
+    async def close(self) -> None:
+        """Stop background jobs and release resources held by the backend."""
+
+
+class UserStatusIndex:
+    """Per-status sets of user IDs, kept in step with ``users_data``."""
+
+    def __init__(self):
+        self.by_status: Dict[str, Set[int]] = {"active": set(), "removed": set()}
+
+    @classmethod
+    def build(cls, users_data: Dict[int, UserRecord]) -> "UserStatusIndex":
+        index = cls()
+        by_status = index.by_status
+        for user_id, record in users_data.items():
+            by_status.setdefault(record.status, set()).add(user_id)
+        return index
+
+    def set_status(self, user_id: int, old_status: Optional[str], new_status: Optional[str]) -> None:
+        if old_status is not None:
+            self.by_status.get(old_status, set()).discard(user_id)
+        if new_status is not None:
+            self.by_status.setdefault(new_status, set()).add(user_id)
+
+    def count(self, status: str) -> int:
+        return len(self.by_status.get(status, ()))
+
+    def ids(self, status: str) -> Set[int]:
+        return self.by_status.get(status, set())
+
+
+class JsonStorage(Storage):
+    """
+    The original backend: data kept in memory and persisted to JSON files.
+
+    Users are ``UserRecord``s keyed by int ID, written back through the
+    write-behind store; spins are appended to the spin ledger.
+    """
+
+    def __init__(self, users_data: Dict[int, UserRecord],
+                 referral_data: Dict[str, Any], credited_referrals: Set[str],
+                 ledger: SpinLedger, index: UserStatusIndex):
+        self.users_data = users_data
+        self.index = index
+        self.referral_data = referral_data
+        self.credited_referrals = credited_referrals
+        self.ledger = ledger
+        self.roulette_stats = ledger.roulette_stats
+
+    def add_user(self, user_id: int, username: str, joined_at: datetime) -> None:
+        old_record = self.users_data.get(user_id)
+        self.index.set_status(user_id, old_record.status if old_record else None, "active")
+        self.users_data[user_id] = UserRecord(username, "active", int(joined_at.timestamp()))
+        write_behind.mark_dirty(USERS_FILE, self.users_data)
+
+    def remove_user(self, user_id: int) -> None:
+        record = self.users_data.get(user_id)
+        if record is not None:
+            self.index.set_status(user_id, record.status, "removed")
+            record.status = "removed"
+            write_behind.mark_dirty(USERS_FILE, self.users_data)
+
+    def get_user_counts(self) -> Dict[str, int]:
+        counts = {status: len(ids) for status, ids in self.index.by_status.items()}
+        counts["total"] = len(self.users_data)
+        return counts
+
+    def iter_user_batches(self, batch_size: int, status: Optional[str] = None,
+                          joined_from: Optional[int] = None,
+                          joined_to: Optional[int] = None) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+        # Снимок ID: между пачками пользователи могут добавляться и удаляться
+        user_ids = list(self.index.ids(status)) if status is not None else list(self.users_data)
+        by_date = joined_from is not None or joined_to is not None
+        for start in range(0, len(user_ids), batch_size):
+            batch = []
+            for user_id in user_ids[start:start + batch_size]:
+                record = self.users_data.get(user_id)
+                if record is None or (status is not None and record.status != status):
+                    continue
+                if by_date:
+                    joined_at = record.joined_at
+                    if joined_at is None or (joined_from is not None and joined_at < joined_from) \
+                            or (joined_to is not None and joined_at >= joined_to):
+                        continue
+                batch.append((user_id, record.to_json()))
+            yield batch
+
+    def iter_active_user_ids(self) -> Iterator[int]:
+        yield from list(self.index.ids("active"))
+
+    def get_roulette_stats(self, user_id: int) -> Dict[str, Any]:
+        stats = self.roulette_stats.get(user_id)
+        return stats.to_json() if stats is not None else new_roulette_stats()
+
+    def record_spin(self, user_id: int, spin_type: str, result: str,
+                    cost: int, value: int, spins_without_win: int) -> None:
+        self.ledger.append(user_id, spin_type, result, cost, value, spins_without_win)
+        self.roulette_version += 1
+
+    def get_global_roulette_stats(self) -> Dict[str, Any]:
+        return self.ledger.totals
+
+    def start(self) -> None:
+        self.ledger.start()
+
+    async def close(self) -> None:
+        await self.ledger.close()
+        if BINARY_SNAPSHOTS:
+            await self.save_snapshot()
+
+    async def save_snapshot(self) -> None:
+        """Flush the users file and write its binary snapshot for the next start."""
+        await write_behind.flush()
+        # Подпись файла и данные берутся в одном шаге цикла: flush, попавший
+        # между ними, выдал бы устаревший снимок за свежий
+        signature = source_signature(USERS_FILE)
+        packed = pack_snapshot({user_id: record.to_tuple() for user_id, record in self.users_data.items()})
+        try:
+            await asyncio.to_thread(write_snapshot, USERS_SNAPSHOT_FILE, USERS_FILE, packed, signature=signature)
+        except Exception as e:
+            logging.error(f"Error writing snapshot {USERS_SNAPSHOT_FILE}: {e}")
@@ -0,0 +1,80 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from config import SUBSCRIPTION_CHANNEL, SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_CACHE_SIZE
+
+
+class SubscriptionService:
+    """
+    Channel subscription checks with a bounded LRU+TTL cache.
+
+    Concurrent checks for the same user share one ``get_chat_member`` call.
+    ``chat_member`` updates from the channel overwrite cached entries, so the
+    cache stays fresh without polling.
+    """
+
+    def __init__(self, chat_id: str = SUBSCRIPTION_CHANNEL, ttl: float = SUBSCRIPTION_CACHE_TTL,
+                 max_size: int = SUBSCRIPTION_CACHE_SIZE):
+        self.chat_id = chat_id
+        self.ttl = ttl
+        self.max_size = max_size
+        # user_id -> (subscribed, stored_at)
+        self._cache: "OrderedDict[int, Tuple[bool, float]]" = OrderedDict()
+        self._in_flight: Dict[int, asyncio.Future] = {}
+
+    @staticmethod
+    def is_member_status(status: str) -> bool:
+        return status not in ["left", "kicked"]
+
+    def matches_chat(self, username: str) -> bool:
+        """Whether a chat username belongs to the tracked channel."""
+        return username is not None and f"@{username}".lower() == self.chat_id.lower()
+
+    async def is_subscribed(self, user_id: int, bot) -> bool:
+        entry = self._cache.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self._cache.move_to_end(user_id)
+            return entry[0]
+
+        future = self._in_flight.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(user_id, bot))
+            self._in_flight[user_id] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(user_id, None))
+        return await asyncio.shield(future)
+
+    def update(self, user_id: int, status: str) -> None:
+        """Store a membership status reported by a ``chat_member`` update."""
+        self._store(user_id, self.is_member_status(status), time.monotonic())
+
+    def invalidate(self, user_id: int) -> None:
+        self._cache.pop(user_id, None)
+
+    async def _fetch(self, user_id: int, bot) -> bool:
+        started = time.monotonic()
+        try:
+            member = await bot.get_chat_member(chat_id=self.chat_id, user_id=user_id)
+        except Exception as e:
+            logging.error(f"Ошибка при проверке подписки: {e}")
+            return False
+
+        subscribed = self.is_member_status(member.status)
+        self._store(user_id, subscribed, started)
+        return subscribed
+
+    def _store(self, user_id: int, subscribed: bool, stored_at: float) -> None:
+        entry = self._cache.get(user_id)
+        if entry is not None and entry[1] > stored_at:
+            # A chat_member update arrived while the request was in flight
+            return
+
+        self._cache[user_id] = (subscribed, stored_at)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+
+subscriptions = SubscriptionService()
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+import sampler
+from sampler import SPIN_TABLES, AliasTable, check_distributions, get_probabilities
+
+
+@pytest.mark.parametrize("key", sorted(SPIN_TABLES), ids=lambda key: f"{key[0]}-x{key[1]:g}")
+def test_alias_table_matches_weights_exactly(key):
+    spin_type, boost_factor = key
+    weights = get_probabilities(spin_type, boost_factor)
+    total = sum(weights.values())
+    implied = SPIN_TABLES[key].implied_probabilities()
+
+    for gift, weight in weights.items():
+        if weight == 0:
+            assert gift not in implied
+        else:
+            # Относительная точность: редкие подарки (0.01%) проверяются так же строго
+            assert implied[gift] == pytest.approx(weight / total, rel=1e-12, abs=0)
+
+
+def test_check_distributions_catches_rare_gift_error(monkeypatch):
+    check_distributions()
+
+    key = ("standard", 1.0)
+    weights = get_probabilities(*key)
+    weights["diamond"] *= 10
+    monkeypatch.setitem(SPIN_TABLES, key, AliasTable(weights))
+    with pytest.raises(ValueError, match="standard x1"):
+        check_distributions()
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_draw_batch(monkeypatch, use_numpy):
+    if use_numpy and sampler.np is None:
+        pytest.skip("numpy is not installed")
+    if not use_numpy:
+        monkeypatch.setattr(sampler, "np", None)
+
+    table = SPIN_TABLES[("basic", 1.0)]
+    first = table.draw_batch(10_000, random.Random(1))
+    assert len(first) == 10_000
+    assert set(first) <= set(table.items)
+    assert first == table.draw_batch(10_000, random.Random(1))
+    assert table.draw_batch(0) == []
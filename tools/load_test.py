@@ -0,0 +1,351 @@
+"""
+End-to-end load harness with a local fake Telegram Bot API server.
+
+Starts an aiohttp stand-in for api.telegram.org (configurable latency,
+global rate limit with 429 responses and random flood errors), points a
+real Bot at it and feeds synthetic updates into the Dispatcher built by
+``main.create_dispatcher``. Every virtual user goes through /start,
+play_game, bet_*, pre_checkout_query and successful_payment; optionally
+the admin then runs a broadcast to everybody.
+
+Reports updates/sec, handler latency percentiles per update kind and the
+outgoing API calls per method. Runs in a scratch data directory, so the
+real data files are never touched. Exits with status 1 when any update
+went unhandled or a handler raised.
+
+    python -m tools.load_test --users 1000 --concurrency 100
+    python -m tools.load_test --latency-ms 50 --api-rate 30 --broadcast
+"""
+import os
+import sys
+import atexit
+import time
+import random
+import asyncio
+import logging
+import shutil
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# config.py resolves the data directory relative to the working directory,
+# so move into a scratch directory before importing the bot modules.
+sys.path.insert(0, str(ROOT))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="loadtest-")
+os.chdir(SCRATCH_DIR)
+
+
+@atexit.register
+def remove_scratch_dir() -> None:
+    os.chdir(ROOT)
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.dispatcher.event.bases import UNHANDLED  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from config import ADMIN_IDS, SPIN_COSTS, HTTP_POOL_SIZE, HTTP_TIMEOUT  # noqa: E402
+from main import create_dispatcher, setup_services  # noqa: E402
+from utils import load_initial_data  # noqa: E402
+from persistence import write_behind  # noqa: E402
+from animation import animations  # noqa: E402
+
+TOKEN = "123456:LOADTEST"
+
+
+class FakeTelegramAPI:
+    """
+    Minimal Bot API server answering every method the bot uses.
+
+    Each call waits ``latency`` seconds (plus up to 50% jitter). Calls above
+    ``rate`` per second, and a random ``flood_rate`` share of the rest, get
+    a 429 with ``retry_after``.
+    """
+
+    def __init__(self, latency: float = 0.0, rate: float = 0, flood_rate: float = 0.0,
+                 retry_after: int = 1):
+        self.latency = latency
+        self.rate = rate
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self._window: List[float] = []
+        self._message_id = 0
+        self._runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _throttled(self) -> bool:
+        if self.flood_rate and random.random() < self.flood_rate:
+            return True
+        if not self.rate:
+            return False
+        now = time.monotonic()
+        while self._window and now - self._window[0] > 1.0:
+            self._window.pop(0)
+        if len(self._window) >= self.rate:
+            return True
+        self._window.append(now)
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1.0, 1.5))
+
+        if self._throttled():
+            self.rejected[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            })
+
+        self.calls[method] += 1
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method in ("sendMessage", "editMessageText", "sendInvoice"):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            return {
+                "message_id": int(params.get("message_id", self._message_id)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", "")
+            }
+        if method == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if method == "getChatMember":
+            return {
+                "status": "member",
+                "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "user"}
+            }
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        return True
+
+
+class Feeder:
+    """Builds synthetic updates and feeds them into the dispatcher."""
+
+    def __init__(self, dp, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.update_id = 0
+        self.message_id = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.unhandled: Counter = Counter()
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, **fields) -> dict:
+        self.message_id += 1
+        return {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **fields
+        }
+
+    async def feed(self, kind: str, user_id: int, **fields) -> None:
+        self.update_id += 1
+        update = {"update_id": self.update_id}
+        if kind == "callback_query":
+            kind = fields["data"].split("_")[0] if fields["data"].startswith("bet_") else fields["data"]
+            update["callback_query"] = {
+                "id": str(self.update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "message": self._message(user_id, text="🎲"),
+                **fields
+            }
+        elif kind == "pre_checkout_query":
+            update["pre_checkout_query"] = {"id": str(self.update_id), "from": self._user(user_id), **fields}
+        else:
+            update["message"] = self._message(user_id, **fields)
+
+        update = Update.model_validate(update, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            response = await self.dp.feed_update(self.bot, update)
+            if response is UNHANDLED:
+                self.unhandled[kind] += 1
+        except Exception as e:
+            self.errors[kind] += 1
+            logging.debug(f"{kind} failed: {e}")
+        finally:
+            self.latencies[kind].append(time.perf_counter() - started)
+
+    async def play(self, user_id: int) -> None:
+        """One user journey: /start, pick a bet, pay and spin."""
+        amount = random.choice(list(SPIN_COSTS.values()))
+        spin_type = next(name for name, cost in SPIN_COSTS.items() if cost == amount)
+
+        await self.feed("/start", user_id, text="/start")
+        await self.feed("callback_query", user_id, data="play_game")
+        await self.feed("callback_query", user_id, data=f"bet_{amount}")
+        await self.feed("pre_checkout_query", user_id, currency="XTR", total_amount=amount,
+                        invoice_payload=f"spin_{spin_type}")
+        await self.feed("successful_payment", user_id, successful_payment={
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": f"spin_{spin_type}",
+            "telegram_payment_charge_id": f"load-{user_id}-{self.update_id}",
+            "provider_payment_charge_id": ""
+        })
+
+    async def broadcast(self, admin_id: int) -> None:
+        await self.feed("callback_query", admin_id, data="create_broadcast")
+        await self.feed("broadcast_message", admin_id, text="Load test broadcast")
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def print_report(feeder: Feeder, api: FakeTelegramAPI, updates: int, elapsed: float) -> None:
+    print(f"\n{updates} updates in {elapsed:.2f} s: {updates / elapsed:.1f} updates/sec")
+
+    print(f"\n{'update':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'errors':>8}{'unhandled':>11}")
+    for kind, values in feeder.latencies.items():
+        print(
+            f"{kind:<22}{len(values):>8}{percentile(values, 50) * 1000:>10.1f}"
+            f"{percentile(values, 95) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}"
+            f"{max(values) * 1000:>10.1f}{feeder.errors[kind]:>8}{feeder.unhandled[kind]:>11}"
+        )
+
+    print(f"\n{'API method':<22}{'calls':>8}{'429':>8}")
+    for method in sorted(set(api.calls) | set(api.rejected)):
+        print(f"{method:<22}{api.calls[method]:>8}{api.rejected[method]:>8}")
+    print(f"{'total':<22}{sum(api.calls.values()):>8}{sum(api.rejected.values()):>8}")
+
+
+async def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+
+async def run(args) -> int:
+    api = FakeTelegramAPI(args.latency_ms / 1000, args.api_rate, args.flood_rate)
+    base_url = await api.start()
+
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(base_url),
+        limit=HTTP_POOL_SIZE,
+        timeout=HTTP_TIMEOUT
+    )
+    bot = Bot(token=TOKEN, session=session)
+    dp = create_dispatcher()
+    initial_data = load_initial_data()
+    setup_services(bot, initial_data)
+    animations.duration = args.animation_duration
+
+    write_behind.start()
+    initial_data["storage"].start()
+    dp.storage.start()
+    initial_data["broadcasts"].start()
+    initial_data["gift_outbox"].start()
+
+    feeder = Feeder(dp, bot)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first_user = 1_000_000
+
+    async def journey(user_id: int) -> None:
+        async with semaphore:
+            await feeder.play(user_id)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(journey(first_user + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        updates = feeder.update_id
+
+        gift_outbox = initial_data["gift_outbox"]
+        if not await wait_for(lambda: not gift_outbox.pending, args.drain_timeout):
+            print(f"{len(gift_outbox.pending)} gifts still pending after {args.drain_timeout} s")
+
+        if args.broadcast:
+            broadcasts = initial_data["broadcasts"]
+            broadcast_started = time.perf_counter()
+            await feeder.broadcast(ADMIN_IDS[0])
+            if await wait_for(lambda: broadcasts.status is None, args.drain_timeout):
+                print(f"Broadcast to {args.users} users took {time.perf_counter() - broadcast_started:.2f} s")
+            else:
+                print(f"Broadcast not finished after {args.drain_timeout} s")
+
+        print_report(feeder, api, updates, elapsed)
+        unhandled = sorted(kind for kind, count in feeder.unhandled.items() if count)
+        failed = sorted(kind for kind, count in feeder.errors.items() if count)
+        if unhandled:
+            print(f"\nFAIL: unhandled updates: {', '.join(unhandled)}")
+        if failed:
+            print(f"\nFAIL: handler errors: {', '.join(failed)}")
+        return 1 if unhandled or failed else 0
+    finally:
+        await initial_data["broadcasts"].close()
+        await initial_data["gift_outbox"].close()
+        await initial_data["storage"].close()
+        await dp.storage.close()
+        await write_behind.close()
+        await bot.session.close()
+        await api.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load test against a fake Bot API server")
+    parser.add_argument("--users", type=int, default=1000, help="virtual users, one spin each")
+    parser.add_argument("--concurrency", type=int, default=100, help="users playing at the same time")
+    parser.add_argument("--latency-ms", type=float, default=30, help="API latency (+0-50%% jitter)")
+    parser.add_argument("--api-rate", type=float, default=0, help="API calls/sec before 429s (0: unlimited)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--animation-duration", type=float, default=animations.duration,
+                        help="roulette animation length in seconds")
+    parser.add_argument("--broadcast", action="store_true", help="run an admin broadcast after the spins")
+    parser.add_argument("--drain-timeout", type=float, default=120,
+                        help="seconds to wait for gift deliveries and the broadcast")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
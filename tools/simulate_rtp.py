@@ -0,0 +1,140 @@
+"""
+Monte Carlo RTP simulator for the roulette odds.
+
+Runs many simulated players through the real pity-counter state machine
+(``spins_without_win`` with the 2x/3x boosts) for every tier in SPIN_COSTS,
+using the same alias tables as ``spin_roulette``, and reports RTP, variance,
+payout percentiles and per-gift frequencies.
+
+Requires NumPy (not a runtime dependency of the bot):
+
+    python -m tools.simulate_rtp --players 1000000 --spins 20
+    python -m tools.simulate_rtp --max-rtp 0.6   # exit code 1 if any tier pays more
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from config import GIFT_VALUES, GIFT_EMOJIS, SPIN_COSTS
+from sampler import BOOST_FACTORS, SPIN_TABLES
+
+
+GIFTS = list(GIFT_VALUES)
+VALUES = np.array([GIFT_VALUES[gift] for gift in GIFTS], dtype=np.int64)
+
+
+def compile_tier(spin_type: str):
+    """Alias tables of one tier as arrays, one row per boost factor."""
+    tables = [SPIN_TABLES[(spin_type, boost_factor)] for boost_factor in BOOST_FACTORS]
+    width = max(len(table.items) for table in tables)
+    prob = np.ones((len(tables), width))
+    items = np.zeros((len(tables), width), dtype=np.int64)
+    alias = np.zeros((len(tables), width), dtype=np.int64)
+    sizes = np.array([len(table.items) for table in tables])
+
+    for row, table in enumerate(tables):
+        n = len(table.items)
+        prob[row, :n] = table.prob
+        items[row, :n] = [GIFTS.index(item) for item in table.items]
+        alias[row, :n] = items[row, table.alias]
+    return prob, items, alias, sizes
+
+
+def simulate_tier(spin_type: str, players: int, spins: int, rng: np.random.Generator) -> dict:
+    cost = SPIN_COSTS[spin_type]
+    prob, items, alias, sizes = compile_tier(spin_type)
+
+    pity = np.zeros(players, dtype=np.int64)
+    won = np.zeros(players, dtype=np.int64)
+    gift_counts = np.zeros(len(GIFTS), dtype=np.int64)
+    boost_counts = np.zeros(len(BOOST_FACTORS), dtype=np.int64)
+    sum_sq = 0
+
+    for _ in range(spins):
+        # Same thresholds as sampler.get_boost_factor: >=4 -> 2x, >=5 -> 3x
+        boost = (pity >= 4).astype(np.int64) + (pity >= 5)
+        u = rng.random(players) * sizes[boost]
+        column = u.astype(np.int64)
+        keep = (u - column) < prob[boost, column]
+        gift = np.where(keep, items[boost, column], alias[boost, column])
+
+        value = VALUES[gift]
+        won += value
+        sum_sq += int(np.dot(value, value))
+        pity = np.where(value >= cost, 0, pity + 1)
+
+        gift_counts += np.bincount(gift, minlength=len(GIFTS))
+        boost_counts += np.bincount(boost, minlength=len(BOOST_FACTORS))
+
+    total_spins = players * spins
+    spent = total_spins * cost
+    mean = won.sum() / total_spins
+    player_rtp = won / (spins * cost)
+
+    return {
+        "spin_type": spin_type,
+        "cost": cost,
+        "rtp": won.sum() / spent,
+        "spin_mean": mean,
+        "spin_variance": sum_sq / total_spins - mean ** 2,
+        "player_rtp_variance": float(player_rtp.var()),
+        "percentiles": dict(zip((1, 5, 50, 95, 99), np.percentile(player_rtp, (1, 5, 50, 95, 99)))),
+        "gift_frequencies": {
+            gift: count / total_spins for gift, count in zip(GIFTS, gift_counts) if count
+        },
+        "boost_frequencies": {
+            boost_factor: count / total_spins
+            for boost_factor, count in zip(BOOST_FACTORS, boost_counts)
+        }
+    }
+
+
+def format_report(report: dict, players: int, spins: int) -> str:
+    lines = [
+        f"== {report['spin_type']} ({report['cost']} ⭐), {players} players x {spins} spins ==",
+        f"RTP: {report['rtp']:.4f}  (house edge {1 - report['rtp']:.2%})",
+        f"Per-spin payout: mean {report['spin_mean']:.2f}, variance {report['spin_variance']:.2f}",
+        f"Per-player RTP variance: {report['player_rtp_variance']:.5f}",
+        "Per-player RTP percentiles: " + ", ".join(
+            f"p{p}={value:.3f}" for p, value in report["percentiles"].items()
+        ),
+        "Boost share: " + ", ".join(
+            f"x{boost_factor:g}={share:.2%}" for boost_factor, share in report["boost_frequencies"].items()
+        ),
+        "Gift frequencies:"
+    ]
+    for gift, frequency in sorted(report["gift_frequencies"].items(), key=lambda x: -x[1]):
+        lines.append(f"  {GIFT_EMOJIS.get(gift, '🎁')} {gift:<10} {GIFT_VALUES[gift]:>4} ⭐  {frequency:.4%}")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--spins", type=int, default=20, help="spins per player")
+    parser.add_argument("--tier", choices=list(SPIN_COSTS), action="append",
+                        help="tier to simulate (default: all)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-rtp", type=float, default=None,
+                        help="fail when the RTP of any tier exceeds this value")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    failed = False
+    for spin_type in args.tier or list(SPIN_COSTS):
+        started = time.perf_counter()
+        report = simulate_tier(spin_type, args.players, args.spins, rng)
+        print(format_report(report, args.players, args.spins))
+        print(f"({time.perf_counter() - started:.1f} s)\n")
+
+        if args.max_rtp is not None and report["rtp"] > args.max_rtp:
+            print(f"FAIL: {spin_type} RTP {report['rtp']:.4f} exceeds {args.max_rtp}")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())